@@ -81,6 +81,49 @@ CHEMISTRY = 31  # Squad Total Chemistry Points: Min X
 
 CHEM_PER_PLAYER = 0  # Chemistry Points Per Player: Min X
 
+# Merge interchangeable cards (same Club, League, Country, Position, Rarity, Color and Rating)
+# into a single integer count variable. This gives a far smaller model on large clubs.
+# The cheapest cards of each class are picked when the solution is expanded back.
+USE_MULTIPLICITY_ENCODING = False
+
+# Find several alternative squads in one session (useful if some cards are gone before submitting).
+# NUM_SQUADS = 1 => Only the best squad is searched for.
+NUM_SQUADS = 1
+MAX_OVERLAP = NUM_PLAYERS - 1 # Max cards shared with each previous squad. NUM_PLAYERS - 1 => K cheapest distinct squads (if solved to optimality).
+ALTERNATIVES_TIME_LIMIT = 1800 # Overall time limit (seconds) for the whole set of squads.
+
+# Solve with coarser prices first (much faster convergence on clubs with very irregular prices),
+# then report the worst-case gap to the true optimal cost. Only used when minimizing the total cost.
+COMPRESS_COST = False
+COST_SIGNIFICANT_DIGITS = 2 # Prices are rounded to X significant digits (4,350 => 4,400). 0 => No rounding.
+POLISH_COST = True # Then re-solve with the exact prices, starting from the compressed solution.
+POLISH_TIME_LIMIT = 60
+
+# Use the solver parameters picked by tune.py for SBCs with similar features
+# (club size, chemistry target, objective and active constraints).
+USE_TUNED_PARAMS = False
+TUNED_PARAMS_FILE = "tuned_params.json"
+
+# Stop the search if the objective doesn't improve for X seconds.
+# Can also be tuned by tune.py (as "stall_time_limit").
+STALL_TIME_LIMIT = 60
+
+# Lexicographic objective: the objectives are optimized one after the other (see SBC_lexicographic).
+# The optimum of each stage is kept fixed while optimizing the next ones.
+# Available: "min_total_cost", "max_duplicates", "min_max_cost", "max_total_cost".
+# Example: ["min_total_cost", "max_duplicates", "min_max_cost"]. Empty => The usual single objective.
+LEXICOGRAPHIC_OBJECTIVES = []
+STAGE_TIME_LIMIT = 600 # Time limit (in seconds) of each stage.
+
+# Save the model, solver parameters, inputs, club hash and solution trajectory of every run
+# into CAPTURE_DIR. Captured runs can be solved again with replay.py (without the club dataset).
+CAPTURE_RUNS = False
+CAPTURE_DIR = "captures"
+
+# The final list of players is written into this file.
+# .csv, .json and .parquet are faster and don't need openpyxl. .xlsx is also supported.
+OUTPUT_FILE = "output.xlsx"
+
 '''INPUTS'''
 
 formation_dict = {
@@ -128,9 +171,10 @@ status_dict = {
 
 def calc_squad_rating(rating):
     '''https://www.reddit.com/r/EASportsFC/comments/5osq7k/new_overall_rating_figured_out'''
+    num_players = len(rating) # Doesn't depend on NUM_PLAYERS, so it's safe to use while the inputs are overridden.
     rat_sum = sum(rating)
-    avg_rat = rat_sum / NUM_PLAYERS
+    avg_rat = rat_sum / num_players
     excess = sum(max(rat - avg_rat, 0) for rat in rating)
-    return round(rat_sum + excess) // NUM_PLAYERS
+    return round(rat_sum + excess) // num_players
 
 LOG_RUNTIME = True
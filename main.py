@@ -1,3 +1,4 @@
+import importlib.util
 import input
 import optimize
 import pandas as pd
@@ -55,20 +56,71 @@ def preprocess_data_2(df: pd.DataFrame):
     df = df.reset_index(drop = True).astype({'Rating': 'int32', 'Cost': 'int32'})
     return df
 
+# Print the stats of a squad and tidy up its columns for the output.
+def format_squad(df_out: pd.DataFrame):
+    df_out.insert(5, 'Is_Pos', df_out.pop('Is_Pos'))
+    print(f"Total Chemistry: {df_out['Chemistry'].sum()}")
+    squad_rating = input.calc_squad_rating(df_out["Rating"].tolist())
+    print(f"Squad Rating: {squad_rating}")
+    print(f"Total Cost: {df_out['Cost'].sum()}")
+    df_out['Org_Row_ID'] = df_out['Original_Idx'] + 2
+    df_out.pop('Original_Idx')
+    return df_out
+
+# Check the output file before solving, so that the squads are not lost after a long solve.
+# Returns the file to write into: .parquet falls back to .csv if neither pyarrow nor fastparquet is installed
+# (and .xlsx if openpyxl is not installed).
+def check_output_file(path: str):
+    engines = {".parquet": ["pyarrow", "fastparquet"], ".xlsx": ["openpyxl"]}
+    for ext, modules in engines.items():
+        if path.endswith(ext) and not any(importlib.util.find_spec(module) for module in modules):
+            csv_path = path[:-len(ext)] + ".csv"
+            print(f"**{' or '.join(modules)} is needed for {path}, the output is written into {csv_path} instead**")
+            return csv_path
+    if not path.endswith((".csv", ".json", ".parquet", ".xlsx")):
+        raise ValueError(f"Unknown output format: {path} (use .csv, .json, .parquet or .xlsx)")
+    return path
+
+# Write the squads into a file. The format is based on the extension (.csv, .json, .parquet or .xlsx).
+# With several squads, the Squad column tells them apart (each squad gets its own sheet in Excel).
+def write_squads(squads: list, path: str):
+    if path.endswith(".xlsx"):
+        # Excel output is optional and much slower. openpyxl is only imported (by pandas) here.
+        if len(squads) == 1:
+            squads[0].to_excel(path, index = False)
+            return
+        with pd.ExcelWriter(path) as writer:
+            for k, df_out in enumerate(squads):
+                df_out.to_excel(writer, sheet_name = f"Squad_{k + 1}", index = False)
+        return
+    df_all = squads[0] if len(squads) == 1 else pd.concat([df_out.assign(Squad = k + 1) for k, df_out in enumerate(squads)], ignore_index = True)
+    if path.endswith(".csv"):
+        df_all.to_csv(path, index = False)
+    elif path.endswith(".json"):
+        df_all.to_json(path, orient = "records", force_ascii = False)
+    elif path.endswith(".parquet"):
+        df_all.to_parquet(path, index = False) # Needs pyarrow or fastparquet.
+    else:
+        print(f"**Couldn't write the output, unknown format: {path}**")
+
 if __name__ == "__main__":
+    output_file = check_output_file(input.OUTPUT_FILE)
     dataset = "Frederik FC_24.csv"
     df = pd.read_csv(dataset, index_col = False)
     # df = preprocess_data_1(df)
     df = preprocess_data_2(df)
     # df.to_excel("Club_Pre_Processed.xlsx", index = False)
-    final_players = optimize.SBC(df)
-    if final_players:
-        df_out = df.iloc[final_players].copy()
-        df_out.insert(5, 'Is_Pos', df_out.pop('Is_Pos'))
-        print(f"Total Chemistry: {df_out['Chemistry'].sum()}")
-        squad_rating = input.calc_squad_rating(df_out["Rating"].tolist())
-        print(f"Squad Rating: {squad_rating}")
-        print(f"Total Cost: {df_out['Cost'].sum()}")
-        df_out['Org_Row_ID'] = df_out['Original_Idx'] + 2
-        df_out.pop('Original_Idx')
-        df_out.to_excel("output.xlsx", index = False)
+    if input.NUM_SQUADS > 1:
+        squads = optimize.SBC_alternatives(df)
+    elif input.LEXICOGRAPHIC_OBJECTIVES:
+        df_out = optimize.SBC_lexicographic(df)
+        squads = [] if df_out is None else [df_out]
+    else:
+        df_out = optimize.SBC(df)
+        squads = [] if df_out is None else [df_out]
+    for k, df_out in enumerate(squads):
+        if len(squads) > 1:
+            print(f"Squad {k + 1}")
+        squads[k] = format_squad(df_out)
+    if squads:
+        write_squads(squads, output_file)
@@ -1,7 +1,17 @@
 import input
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
 from threading import Timer
 import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
 from ortools.sat.python import cp_model
+import ortools
 
 def runtime(func):
     '''Wrapper function to log the execution time'''
@@ -34,6 +44,28 @@ class ObjectiveEarlyStopping(cp_model.CpSolverSolutionCallback):
         print(f"{self._timer_limit} seconds without improvement in objective. ")
         super().StopSearch()
 
+    def cancel_search(self):
+        '''Stop the search without the early stopping message (e.g. cancelled by the user).'''
+        super().StopSearch()
+
+    def cancel_timer(self):
+        '''Cancel the pending timer once the search is over.'''
+        if self._timer:
+            self._timer.cancel()
+
+class SolutionStreamer(ObjectiveEarlyStopping):
+    '''Early stopping callback that also reports every improving solution.
+    on_solution(callback) is called from the solver thread, so the values of the
+    current solution can be read with callback.Value.
+    '''
+    def __init__(self, timer_limit: int, on_solution):
+        super().__init__(timer_limit)
+        self._on_solution = on_solution
+
+    def on_solution_callback(self):
+        super().on_solution_callback()
+        self._on_solution(self)
+
 @runtime
 def create_var(model, df, map_idx, num_cnts):
     '''Create the relevant variables'''
@@ -48,8 +80,13 @@ def create_var(model, df, map_idx, num_cnts):
         "Club": {}, "League": {}, "Country": {}, "Position": {},
         "Rating": {}, "Color": {}, "Rarity": {}, "Name": {}
     }
+    multiplicity = get_multiplicity(df)
     for i in range(num_players):
-        player.append(model.NewBoolVar(f"player{i}"))
+        if multiplicity[i] > 1:
+            # player[i] = number of cards considered from the i^th class of interchangeable cards.
+            player.append(model.NewIntVar(0, min(multiplicity[i], input.NUM_PLAYERS), f"player{i}"))
+        else:
+            player.append(model.NewBoolVar(f"player{i}"))
         chem.append(model.NewIntVar(0, 3, f"chem{i}"))
         players_grouped["Club"][map_idx["Club"][df.at[i, "Club"]]] = players_grouped["Club"].get(map_idx["Club"][df.at[i, "Club"]], []) + [player[i]]
         players_grouped["League"][map_idx["League"][df.at[i,"League"]]] = players_grouped["League"].get(map_idx["League"][df.at[i,"League"]], []) + [player[i]]
@@ -58,7 +95,8 @@ def create_var(model, df, map_idx, num_cnts):
         players_grouped["Rating"][map_idx["Rating"][df.at[i, "Rating"]]] = players_grouped["Rating"].get(map_idx["Rating"][df.at[i, "Rating"]], []) + [player[i]]
         players_grouped["Color"][map_idx["Color"][df.at[i, "Color"]]] = players_grouped["Color"].get(map_idx["Color"][df.at[i, "Color"]], []) + [player[i]]
         players_grouped["Rarity"][map_idx["Rarity"][df.at[i, "Rarity"]]] = players_grouped["Rarity"].get(map_idx["Rarity"][df.at[i, "Rarity"]], []) + [player[i]]
-        players_grouped["Name"][map_idx["Name"][df.at[i, "Name"]]] = players_grouped["Name"].get(map_idx["Name"][df.at[i, "Name"]], []) + [player[i]]
+        if multiplicity[i] == 1: # Names within a merged class are unique in the club dataset.
+            players_grouped["Name"][map_idx["Name"][df.at[i, "Name"]]] = players_grouped["Name"].get(map_idx["Name"][df.at[i, "Name"]], []) + [player[i]]
 
     # These variables are basically chemistry of each club, league and nation
     z_club = [model.NewIntVar(0, 3, f"z_club{i}") for i in range(num_clubs)]
@@ -174,15 +212,29 @@ def create_squad_rating_constraint_2(df, model, player, map_idx, players_grouped
     https://www.reddit.com/r/EASportsFC/comments/5osq7k/new_overall_rating_figured_out.
     Probably more accurate.
     '''
-    num_players = num_cnts[0]
     rating = df["Rating"].tolist()
     avg_rat = cp_model.LinearExpr.WeightedSum(player, rating) # Assuming that the original ratings have been scaled by 11 (input.NUM_PLAYERS).
     # This represents the max non-negative gap between player rating and squad avg_rating.
     # Should be set to a reasonable amount to avoid overwhelming the solver.
     # Good solutions likely don't have large gap anyways.
     max_gap_bw_rating = min(150, (df["Rating"].max() - df["Rating"].min()) * (input.NUM_PLAYERS - 1)) # max_rat * 11 - (min_rat * 10 + max_rat) (seems alright).
-    excess = [model.NewIntVar(0, max_gap_bw_rating, f"excess{i}") for i in range(num_players)]
-    [model.AddMaxEquality(excess[i], [(player[i] * rat * input.NUM_PLAYERS - avg_rat), 0])  for i, rat in enumerate(rating)]
+    multiplicity = get_multiplicity(df)
+    excess = []
+    for i, rat in enumerate(rating):
+        if multiplicity[i] > 1:
+            # Every card of a merged class contributes the same excess.
+            # The gap is only capped if the class is picked (like player[i] * rat in the else branch).
+            unit_excess = model.NewIntVar(0, (df["Rating"].max() - df["Rating"].min()) * input.NUM_PLAYERS, f"unit_excess{i}")
+            model.AddMaxEquality(unit_excess, [(rat * input.NUM_PLAYERS - avg_rat), 0])
+            selected = model.NewBoolVar(f"selected{i}")
+            model.Add(player[i] >= 1).OnlyEnforceIf(selected)
+            model.Add(player[i] == 0).OnlyEnforceIf(selected.Not())
+            model.Add(unit_excess <= max_gap_bw_rating).OnlyEnforceIf(selected)
+            excess.append(model.NewIntVar(0, max_gap_bw_rating * min(multiplicity[i], input.NUM_PLAYERS), f"excess{i}"))
+            model.AddMultiplicationEquality(excess[i], [player[i], unit_excess])
+        else:
+            excess.append(model.NewIntVar(0, max_gap_bw_rating, f"excess{i}"))
+            model.AddMaxEquality(excess[i], [(player[i] * rat * input.NUM_PLAYERS - avg_rat), 0])
     sum_excess = cp_model.LinearExpr.Sum(excess)
     model.Add((avg_rat * input.NUM_PLAYERS + sum_excess) >= (input.SQUAD_RATING) * (input.NUM_PLAYERS) * (input.NUM_PLAYERS))
     return model
@@ -235,49 +287,95 @@ def create_min_overall_constraint(df, model, player, map_idx, players_grouped, n
         model.Add(cp_model.LinearExpr.Sum(expr) >= input.NUM_MIN_OVERALL[i])
     return model
 
+def create_player_chemistry(df, model, i, player_i, chem_i, multiplicity_i, z_club, z_league, z_nation, map_idx):
+    '''Chemistry of the i^th player (see create_chemistry_constraint).
+    Returns pos[i], the in position variable of player[i] and the chemistry it adds to the squad.
+    '''
+    formation_list = input.formation_dict[input.FORMATION]
+    club_dict, league_dict, country_dict = map_idx["Club"], map_idx["League"], map_idx["Country"]
+    p_club, p_league, p_nation, p_pos = df.at[i, "Club"], df.at[i, "League"], df.at[i, "Country"], df.at[i, "Position"]
+    if multiplicity_i > 1:
+        pos_i = model.NewIntVar(0, min(multiplicity_i, input.NUM_PLAYERS), f"_pos{i}")
+        model.Add(pos_i <= player_i)
+    else:
+        pos_i = model.NewBoolVar(f"_pos{i}")
+    if p_pos in formation_list:
+        if input.PLAYERS_IN_POSITION == True:
+            model.Add(pos_i == (player_i if multiplicity_i > 1 else 1))
+        if df.at[i, "Rarity"] in ["Icon", "UT Heroes"]:
+            model.Add(chem_i == 3)
+        elif df.at[i, "Rarity"] in ["Radioactive", "FC Versus Ice", "FC Versus Fire"]:
+            model.Add(chem_i == 2)
+        else:
+            sum_expr = z_club[club_dict[p_club]] + z_league[league_dict[p_league]] + z_nation[country_dict[p_nation]]
+            b = model.NewBoolVar(f"b{i}")
+            model.Add(sum_expr <= 3).OnlyEnforceIf(b)
+            model.Add(sum_expr > 3).OnlyEnforceIf(b.Not())
+            model.Add(chem_i == sum_expr).OnlyEnforceIf(b)
+            model.Add(chem_i == 3).OnlyEnforceIf(b.Not())
+    else:
+        model.Add(chem_i == 0)
+        model.Add(pos_i == 0)
+
+    if multiplicity_i > 1:
+        selected = model.NewBoolVar(f"selected{i}")
+        model.Add(player_i >= 1).OnlyEnforceIf(selected)
+        model.Add(player_i == 0).OnlyEnforceIf(selected.Not())
+        model.Add(chem_i >= input.CHEM_PER_PLAYER).OnlyEnforceIf(selected)
+        play_pos = pos_i
+    else:
+        model.Add(chem_i >= input.CHEM_PER_PLAYER).OnlyEnforceIf(player_i)
+        play_pos = model.NewBoolVar(f"play_pos{i}")
+        model.AddMultiplicationEquality(play_pos, player_i, pos_i)
+    player_chem_expr = model.NewIntVar(0, 3 * min(multiplicity_i, input.NUM_PLAYERS), f"chem_expr{i}")
+    model.AddMultiplicationEquality(player_chem_expr, play_pos, chem_i)
+    return pos_i, play_pos, player_chem_expr
+
+def get_chem_weight(field, rarity):
+    '''How much a card placed in position counts towards the chemistry of its Club, League or Country.
+    Note: Icons also count towards every League in the squad (see create_chemistry_constraint).
+    '''
+    if field == "Club":
+        if rarity in ["Icon", "UT Heroes"]: # Heroes or Icons don't contribute to club chem.
+            return 0
+        if rarity == "Radioactive": # Radioactive cards contribute 2x to club chem.
+            return 2
+        if rarity == "FC Versus Ice": # Ice cards contribute 5x to club chem.
+            return 5
+    elif field == "League":
+        if rarity in ["UT Heroes", "Radioactive"]: # Heroes / Radioactive cards contribute 2x to league chem.
+            return 2
+    elif field == "Country":
+        if rarity in ["Icon", "Radioactive"]: # Icons / Radioactive cards contribute 2x to country chem.
+            return 2
+        if rarity == "FC Versus Fire": # Fire cards contribute 5x to country chem.
+            return 5
+    return 1
+
 @runtime
-def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, player, players_grouped, num_cnts, map_idx, b_c, b_l, b_n):
+def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, player, players_grouped, num_cnts, map_idx, b_c, b_l, b_n, state = None):
     '''Optimize Chemistry (>=)
     (https://www.rockpapershotgun.com/fifa-23-chemistry)
+    state => Optional dict filled with the indexes of the chemistry constraints (see SBCSession).
     '''
     num_players, num_clubs, num_league, num_country = num_cnts[0], num_cnts[1], num_cnts[2], num_cnts[3]
 
-    club_dict, league_dict, country_dict, pos_dict = map_idx["Club"], map_idx["League"], map_idx["Country"], map_idx["Position"]
+    pos_dict = map_idx["Position"]
 
     formation_list = input.formation_dict[input.FORMATION]
 
+    multiplicity = get_multiplicity(df)
+
     pos = [] # pos[i] = 1 => player[i] should be placed in their position.
-    m_pos, m_idx = {}, {}
+             # With multiplicity encoding, pos[i] = number of cards of the i^th class placed in their position.
+    in_pos, m_idx = {}, {} # in_pos[player[i]] => How many of player[i] are considered and placed in their position.
     chem_expr = []
 
     for i in range(num_players):
-        p_club, p_league, p_nation, p_pos = df.at[i, "Club"], df.at[i, "League"], df.at[i, "Country"], df.at[i, "Position"]
-        pos.append(model.NewBoolVar(f"_pos{i}"))
-        m_pos[player[i]] = pos[i]
+        pos_i, play_pos, player_chem_expr = create_player_chemistry(df, model, i, player[i], chem[i], multiplicity[i], z_club, z_league, z_nation, map_idx)
+        pos.append(pos_i)
         m_idx[player[i]] = i
-        if p_pos in formation_list:
-            if input.PLAYERS_IN_POSITION == True:
-                model.Add(pos[i] == 1)
-            if df.at[i, "Rarity"] in ["Icon", "UT Heroes"]:
-                model.Add(chem[i] == 3)
-            elif df.at[i, "Rarity"] in ["Radioactive", "FC Versus Ice", "FC Versus Fire"]:
-                model.Add(chem[i] == 2)
-            else:
-                sum_expr = z_club[club_dict[p_club]] + z_league[league_dict[p_league]] + z_nation[country_dict[p_nation]]
-                b = model.NewBoolVar(f"b{i}")
-                model.Add(sum_expr <= 3).OnlyEnforceIf(b)
-                model.Add(sum_expr > 3).OnlyEnforceIf(b.Not())
-                model.Add(chem[i] == sum_expr).OnlyEnforceIf(b)
-                model.Add(chem[i] == 3).OnlyEnforceIf(b.Not())
-        else:
-            model.Add(chem[i] == 0)
-            model.Add(pos[i] == 0)
-
-        model.Add(chem[i] >= input.CHEM_PER_PLAYER).OnlyEnforceIf(player[i])
-        play_pos = model.NewBoolVar(f"play_pos{i}")
-        model.AddMultiplicationEquality(play_pos, player[i], pos[i])
-        player_chem_expr = model.NewIntVar(0, 3, f"chem_expr{i}")
-        model.AddMultiplicationEquality(player_chem_expr, play_pos, chem[i])
+        in_pos[player[i]] = play_pos
         chem_expr.append(player_chem_expr)
 
     pos_expr = [] # Players whose position is there in the input formation.
@@ -287,15 +385,15 @@ def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, pla
         solution but we only need at-most 2 of them to be in position for a 3-4-3
         formation and be considered for chemistry calcuation.
     '''
+    chem_constraints = {"Position": {}, "Club": {}, "League": {}, "Country": {}} # Indexes of the constraints on in_pos.
     for Pos in set(formation_list):
         if Pos not in pos_dict:
                 continue
         t_expr = players_grouped["Position"].get(pos_dict[Pos], [])
         pos_expr += t_expr
         if input.PLAYERS_IN_POSITION == False:
-            play_pos = [model.NewBoolVar(f"play_pos{Pos}{i}") for i in range(len(t_expr))]
-            [model.AddMultiplicationEquality(play_pos[i], p, m_pos[p]) for i, p in enumerate(t_expr)]
-            model.Add(cp_model.LinearExpr.Sum(play_pos) <= formation_list.count(Pos))
+            play_pos = [in_pos[p] for p in t_expr]
+            chem_constraints["Position"][Pos] = model.Add(cp_model.LinearExpr.Sum(play_pos) <= formation_list.count(Pos)).Index()
 
     club_bucket = [[0, 1], [2, 3], [4, 6], [7, input.NUM_PLAYERS]]
 
@@ -305,21 +403,17 @@ def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, pla
         # Since only such players would contribute towards chemistry.
         t_expr_1 = list(set(t_expr) & set(pos_expr))
         expr = []
-        for i, p in enumerate(t_expr_1):
-            if df.at[m_idx[p], "Rarity"] in ["Icon", "UT Heroes"]: # Heroes or Icons don't contribute to club chem.
-                continue
-            t_var = model.NewBoolVar(f"t_var_c{i}")
-            model.AddMultiplicationEquality(t_var, p, m_pos[p])
-            if df.at[m_idx[p], "Rarity"] == "Radioactive": # Radioactive cards contribute 2x to club chem.
-                expr.append(2 * t_var)
-            elif df.at[m_idx[p], "Rarity"] == "FC Versus Ice": # Ice cards contribute 5x to club chem.
-                expr.append(5 * t_var)
-            else:
-                expr.append(t_var)
+        for p in t_expr_1:
+            weight = get_chem_weight("Club", df.at[m_idx[p], "Rarity"])
+            if weight:
+                expr.append(weight * in_pos[p])
         sum_expr = cp_model.LinearExpr.Sum(expr)
+        chem_constraints["Club"][j] = []
         for idx in range(4):
             lb, ub = club_bucket[idx][0], club_bucket[idx][1]
-            model.AddLinearConstraint(sum_expr, lb, ub).OnlyEnforceIf(b_c[j][idx])
+            bucket = model.AddLinearConstraint(sum_expr, lb, ub)
+            bucket.OnlyEnforceIf(b_c[j][idx])
+            chem_constraints["Club"][j].append(bucket.Index())
             model.Add(z_club[j] == idx).OnlyEnforceIf(b_c[j][idx])
         model.AddExactlyOne(b_c[j])
 
@@ -333,18 +427,14 @@ def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, pla
         # We need players from j^th league whose position is there in the input formation.
         # Since only such players would contribute towards chemistry.
         t_expr_1 = list(set(t_expr) & set(pos_expr))
-        expr = []
-        for i, p in enumerate(t_expr_1):
-            t_var = model.NewBoolVar(f"t_var_l{i}")
-            model.AddMultiplicationEquality(t_var, p, m_pos[p])
-            if df.at[m_idx[p], "Rarity"] in ["UT Heroes", "Radioactive"]:  # Heroes / Radioactive cards contribute 2x to league chem.
-                expr.append(2 * t_var)
-            else:
-                expr.append(t_var)
+        expr = [get_chem_weight("League", df.at[m_idx[p], "Rarity"]) * in_pos[p] for p in t_expr_1]
         sum_expr = cp_model.LinearExpr.Sum(expr)
+        chem_constraints["League"][j] = []
         for idx in range(4):
             lb, ub = league_bucket[idx][0], league_bucket[idx][1]
-            model.AddLinearConstraint(sum_expr, lb, ub).OnlyEnforceIf(b_l[j][idx])
+            bucket = model.AddLinearConstraint(sum_expr, lb, ub)
+            bucket.OnlyEnforceIf(b_l[j][idx])
+            chem_constraints["League"][j].append(bucket.Index())
             model.Add(z_league[j] == idx).OnlyEnforceIf(b_l[j][idx])
         model.AddExactlyOne(b_l[j])
 
@@ -355,24 +445,20 @@ def create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, pla
         # We need players from j^th country whose position is there in the input formation.
         # Since only such players would contribute towards chemistry.
         t_expr_1 = list(set(t_expr) & set(pos_expr))
-        expr = []
-        for i, p in enumerate(t_expr_1):
-            t_var = model.NewBoolVar(f"t_var_n{i}")
-            model.AddMultiplicationEquality(t_var, p, m_pos[p])
-            if df.at[m_idx[p], "Rarity"] in ["Icon", "Radioactive"]:  # Icons / Radioactive cards contribute 2x to country chem.
-                expr.append(2 * t_var)
-            elif df.at[m_idx[p], "Rarity"] == "FC Versus Fire": # Fire cards contribute 5x to country chem.
-                expr.append(5 * t_var)
-            else:
-                expr.append(t_var)
+        expr = [get_chem_weight("Country", df.at[m_idx[p], "Rarity"]) * in_pos[p] for p in t_expr_1]
         sum_expr = cp_model.LinearExpr.Sum(expr)
+        chem_constraints["Country"][j] = []
         for idx in range(4):
             lb, ub = country_bucket[idx][0], country_bucket[idx][1]
-            model.AddLinearConstraint(sum_expr, lb, ub).OnlyEnforceIf(b_n[j][idx])
+            bucket = model.AddLinearConstraint(sum_expr, lb, ub)
+            bucket.OnlyEnforceIf(b_n[j][idx])
+            chem_constraints["Country"][j].append(bucket.Index())
             model.Add(z_nation[j] == idx).OnlyEnforceIf(b_n[j][idx])
         model.AddExactlyOne(b_n[j])
 
-    model.Add(cp_model.LinearExpr.Sum(chem_expr) >= input.CHEMISTRY)
+    chem_constraints["Total"] = model.Add(cp_model.LinearExpr.Sum(chem_expr) >= input.CHEMISTRY).Index()
+    if state is not None:
+        state["chem_constraints"] = chem_constraints
     return model, pos, chem_expr
 
 @runtime
@@ -500,10 +586,12 @@ def prioritize_duplicates(df, model, player):
         return model
     duplicates = [player[j] for j in dup_idxes]
     dup_expr = cp_model.LinearExpr.Sum(duplicates)
+    multiplicity = get_multiplicity(df)
+    num_dup = sum(multiplicity[j] for j in dup_idxes)
     if input.USE_ALL_DUPLICATES:
-        model.Add(dup_expr == min(input.NUM_PLAYERS, len(dup_idxes)))
+        model.Add(dup_expr == min(input.NUM_PLAYERS, num_dup))
     elif input.USE_AT_LEAST_HALF_DUPLICATES:
-        model.Add(2 * dup_expr >= min(input.NUM_PLAYERS, len(dup_idxes)))
+        model.Add(2 * dup_expr >= min(input.NUM_PLAYERS, num_dup))
     elif input.USE_AT_LEAST_ONE_DUPLICATE:
         model.Add(dup_expr >= 1)
     return model
@@ -537,17 +625,168 @@ def set_objective(df, model, player):
     if input.MINIMIZE_MAX_COST:
         print("**MINIMIZE_MAX_COST**")
         max_cost = model.NewIntVar(0, df["Cost"].max(), "max_cost")
-        play_cost = [player[i] * cost[i] for i in range(len(cost))]
+        if "Multiplicity" in df.columns:
+            play_cost = create_class_cost(df, model, player, prefix = False)
+        else:
+            play_cost = [player[i] * cost[i] for i in range(len(cost))]
         model.AddMaxEquality(max_cost, play_cost)
         model.Minimize(max_cost)
     elif input.MAXIMIZE_TOTAL_COST:
         print("**MAXIMIZE_TOTAL_COST**")
-        model.Maximize(cp_model.LinearExpr.WeightedSum(player, cost))
+        if "Multiplicity" in df.columns:
+            model.Maximize(cp_model.LinearExpr.Sum(create_class_cost(df, model, player)))
+        else:
+            model.Maximize(cp_model.LinearExpr.WeightedSum(player, cost))
     else:
         print("**MINIMIZE_TOTAL_COST**")
-        model.Minimize(cp_model.LinearExpr.WeightedSum(player, cost))
+        if "Multiplicity" in df.columns:
+            model.Minimize(cp_model.LinearExpr.Sum(create_class_cost(df, model, player)))
+        else:
+            model.Minimize(cp_model.LinearExpr.WeightedSum(player, cost))
+    return model
+
+def create_stage_objective(df, model, player, stage):
+    '''Objective expression of a stage of the lexicographic objective (see SBC_lexicographic).
+    Returns the expression and whether it should be maximized.
+    '''
+    cost = df["Cost"].tolist()
+    if stage == "min_total_cost" or stage == "max_total_cost":
+        if "Multiplicity" in df.columns:
+            expr = cp_model.LinearExpr.Sum(create_class_cost(df, model, player))
+        else:
+            expr = cp_model.LinearExpr.WeightedSum(player, cost)
+        return expr, stage == "max_total_cost"
+    if stage == "min_max_cost":
+        max_cost = model.NewIntVar(0, df["Cost"].max(), "stage_max_cost")
+        if "Multiplicity" in df.columns:
+            play_cost = create_class_cost(df, model, player, prefix = False)
+        else:
+            play_cost = [player[i] * cost[i] for i in range(len(cost))]
+        model.AddMaxEquality(max_cost, play_cost)
+        return max_cost, False
+    if stage == "max_duplicates":
+        dup_idxes = list(df[(df["IsDuplicate"] == True)].index) if "IsDuplicate" in df.columns else []
+        if not dup_idxes:
+            print("**No Duplicates Found!**")
+        return cp_model.LinearExpr.Sum([player[j] for j in dup_idxes]), True
+    raise ValueError(f"Unknown objective: {stage}")
+
+def round_cost(cost):
+    '''Round a price to input.COST_SIGNIFICANT_DIGITS significant digits'''
+    num_digits = len(str(abs(int(cost))))
+    if input.COST_SIGNIFICANT_DIGITS <= 0 or num_digits <= input.COST_SIGNIFICANT_DIGITS:
+        return int(cost)
+    unit = 10 ** (num_digits - input.COST_SIGNIFICANT_DIGITS)
+    return int(round(cost / unit)) * unit
+
+@runtime
+def compress_cost(df):
+    '''Round the prices to a coarser grid and divide out their common GCD.
+    Returns a copy of df with the compressed Cost (and Member_Cost) and the
+    scale to go back to coins.
+    '''
+    df_comp = df.copy()
+    df_comp["Cost"] = df["Cost"].apply(round_cost)
+    all_cost = df_comp["Cost"].tolist()
+    if "Member_Cost" in df.columns:
+        df_comp["Member_Cost"] = df["Member_Cost"].apply(lambda member_cost: [round_cost(cost) for cost in member_cost])
+        all_cost += [cost for member_cost in df_comp["Member_Cost"] for cost in member_cost]
+    scale = max(int(np.gcd.reduce(all_cost)), 1)
+    df_comp["Cost"] = df_comp["Cost"] // scale
+    if "Member_Cost" in df.columns:
+        df_comp["Member_Cost"] = df_comp["Member_Cost"].apply(lambda member_cost: [cost // scale for cost in member_cost])
+    print(f"Cost compression: {df['Cost'].nunique()} => {df_comp['Cost'].nunique()} distinct prices, scale {scale}")
+    return df_comp, scale
+
+def report_cost_gap(df_club, final_players, bound, exact_bound = 0):
+    '''Report the worst-case gap between the true cost of a squad found with compressed
+    prices and the true optimal cost. bound is the objective bound in coins.
+    If c' are the compressed prices and x* the true optimal squad then c'(x*) >= bound, so
+    c(x*) >= bound - (sum of the NUM_PLAYERS largest c'_i - c_i) and c(x*) >= bound / (1 + max (c'_i - c_i) / c_i).
+    exact_bound => Objective bound with the true prices (e.g. from polishing), also c(x*) >= exact_bound.
+    '''
+    cost = df_club["Cost"]
+    over = (cost.apply(round_cost) - cost).clip(lower = 0)
+    max_rel_over = (over[cost > 0] / cost[cost > 0]).max() if (cost > 0).any() else 0
+    lower_bound = max(bound - over.nlargest(input.NUM_PLAYERS).sum(), bound / (1 + max_rel_over), exact_bound, 0)
+    true_cost = int(cost.iloc[final_players].sum())
+    gap = max(true_cost - lower_bound, 0)
+    print(f"True Cost: {true_cost}, Worst-case gap to the optimal cost: {round(gap)} ({round(100 * gap / max(true_cost, 1), 2)}%)")
+    return gap
+
+def create_class_cost(df, model, player, prefix = True):
+    '''Cost of each class of interchangeable cards (multiplicity encoding).
+    Members of a class are sorted by price, so if player[i] = k then the first k
+    members are used. prefix = True => sum of their prices, otherwise the price
+    of the k^th member (i.e. the max cost within the class).
+    '''
+    class_cost = []
+    for i, member_cost in enumerate(df["Member_Cost"]):
+        if len(member_cost) == 1:
+            class_cost.append(player[i] * member_cost[0])
+            continue
+        member_cost = member_cost[:min(len(member_cost), input.NUM_PLAYERS)]
+        if prefix:
+            table = [sum(member_cost[:k]) for k in range(len(member_cost) + 1)]
+        else:
+            table = [0] + member_cost
+        cost_var = model.NewIntVar(min(table), max(table), f"class_cost{i}")
+        model.AddElement(player[i], table, cost_var)
+        class_cost.append(cost_var)
+    return class_cost
+
+@runtime
+def create_overlap_constraint(df, model, player, squad, max_overlap):
+    '''At most max_overlap cards of a previous squad can be used again (no-good cut).
+    squad[i] = value of player[i] in the previous squad.
+    Different versions (alternate positions) of the same card count as the same card.
+    '''
+    multiplicity = get_multiplicity(df)
+    card_id = df["Original_Idx"].tolist() if "Original_Idx" in df.columns else list(range(df.shape[0]))
+    used_cards = {card_id[i] for i, num in enumerate(squad) if num and multiplicity[i] == 1}
+    expr = []
+    for i in range(df.shape[0]):
+        if multiplicity[i] > 1:
+            if squad[i]:
+                # Cards of a merged class are interchangeable, so min(player[i], squad[i]) of them overlap.
+                overlap = model.NewIntVar(0, squad[i], f"overlap{i}")
+                model.AddMinEquality(overlap, [player[i], squad[i]])
+                expr.append(overlap)
+        elif card_id[i] in used_cards:
+            expr.append(player[i])
+    model.Add(cp_model.LinearExpr.Sum(expr) <= max_overlap)
     return model
 
+def get_multiplicity(df):
+    '''Number of interchangeable cards behind each row (always 1 without multiplicity encoding)'''
+    if "Multiplicity" in df.columns:
+        return df["Multiplicity"].tolist()
+    return [1] * df.shape[0]
+
+@runtime
+def group_interchangeable_cards(df):
+    '''Merge cards that only differ in Name and Cost into classes of interchangeable cards.
+    Cards whose Name appears in more than one row (alternate positions, duplicates) and
+    fixed players are left alone, so the unique player constraint stays exact.
+    Returns one row per class with the members sorted by Cost (cheapest first, or
+    most expensive first when maximizing the total cost).
+    '''
+    key = ["Club", "League", "Country", "Position", "Rarity", "Color", "Rating"]
+    if "IsDuplicate" in df.columns:
+        key.append("IsDuplicate")
+    df_sorted = df.sort_values("Cost", ascending = not input.MAXIMIZE_TOTAL_COST, kind = "stable")
+    mergeable = df_sorted["Name"].map(df_sorted["Name"].value_counts()) == 1
+    if input.FIX_PLAYERS and "Original_Idx" in df_sorted.columns:
+        mergeable &= ~df_sorted["Original_Idx"].isin([idx - 2 for idx in input.FIX_PLAYERS])
+    single = df_sorted.index.to_series().where(~mergeable, -1) # Rows that are not mergeable form their own class.
+    label = df_sorted.assign(_Single = single).groupby(key + ["_Single"], sort = False, dropna = False).ngroup()
+    df_class = df_sorted[~label.duplicated()].reset_index(drop = True)
+    df_class["Member_Idx"] = df_sorted.index.to_series().groupby(label).agg(list).tolist()
+    df_class["Member_Cost"] = df_sorted["Cost"].astype(int).groupby(label).agg(list).tolist()
+    df_class["Multiplicity"] = df_class["Member_Idx"].str.len()
+    print(f"Multiplicity encoding: {df.shape[0]} cards merged into {df_class.shape[0]} classes")
+    return df_class
+
 def get_dict(df, col):
     '''Map fields to a unique index'''
     d = {}
@@ -556,9 +795,80 @@ def get_dict(df, col):
         d[val] = i
     return d
 
+# Comment out the constraints not required (see named_constraints).
+sbc_constraints = [
+    # Club
+    # "club",
+    "max_club",
+    # "min_club",
+    # "unique_club",
+
+    # League
+    # "league",
+    # "max_league",
+    # "min_league",
+    "unique_league",
+
+    # Country
+    # "country",
+    # "max_country",
+    # "min_country",
+    "unique_country",
+
+    # Rarity
+    # "rarity_1",
+    "rarity_2",
+
+    # Squad Rating
+    "squad_rating_3",
+
+    # Min Overall
+    # "min_overall",
+
+    # Duplicates
+    # "duplicates",
+]
+
+def create_sbc_constraints(df, model, player, club, league, country, map_idx, players_grouped, num_cnts):
+    '''Create the constraints in sbc_constraints'''
+    return create_named_constraints(sbc_constraints, df, model, player, club, league, country, map_idx, players_grouped, num_cnts)
+
+# Constraints that can be given by name, e.g. in a challenge spec.
+named_constraints = {
+    "club": create_club_constraint, "max_club": create_max_club_constraint,
+    "min_club": create_min_club_constraint, "unique_club": create_unique_club_constraint,
+    "league": create_league_constraint, "max_league": create_max_league_constraint,
+    "min_league": create_min_league_constraint, "unique_league": create_unique_league_constraint,
+    "country": create_country_constraint, "max_country": create_max_country_constraint,
+    "min_country": create_min_country_constraint, "unique_country": create_unique_country_constraint,
+    "rarity_1": create_rarity_1_constraint, "rarity_2": create_rarity_2_constraint,
+    "squad_rating_1": create_squad_rating_constraint_1, "squad_rating_2": create_squad_rating_constraint_2,
+    "squad_rating_3": create_squad_rating_constraint_3, "min_overall": create_min_overall_constraint,
+    "duplicates": prioritize_duplicates
+}
+
+def create_named_constraints(constraints, df, model, player, club, league, country, map_idx, players_grouped, num_cnts):
+    '''Create the constraints given by name (e.g. ["max_club", "unique_league", "squad_rating_3"])
+    instead of the ones in sbc_constraints.
+    '''
+    unique_vars = {"unique_club": club, "unique_league": league, "unique_country": country}
+    for name in constraints:
+        if name not in named_constraints:
+            raise ValueError(f"Unknown constraint: {name}")
+        if name == "duplicates":
+            model = named_constraints[name](df, model, player)
+        elif name in unique_vars:
+            model = named_constraints[name](df, model, player, unique_vars[name], map_idx, players_grouped, num_cnts)
+        else:
+            model = named_constraints[name](df, model, player, map_idx, players_grouped, num_cnts)
+    return model
+
 @runtime
-def SBC(df):
-    '''Optimize SBC using Constraint Integer Programming'''
+def create_model(df, constraints = None, state = None):
+    '''Create the CP-SAT model with the SBC constraints and the objective.
+    constraints = None => The constraints in sbc_constraints are used.
+    state => Optional dict that is filled with the variables and groups used to extend the model (see SBCSession).
+    '''
     num_cnts = [df.shape[0], df.Club.nunique(), df.League.nunique(), df.Country.nunique()] # Count of important fields
 
     map_idx= {} # Map fields to a unique index
@@ -573,68 +883,81 @@ def SBC(df):
     model, player, chem, z_club, z_league, z_nation, b_c, b_l, b_n, club, country, league, players_grouped = create_var(model, df, map_idx, num_cnts)
 
     '''Essential constraints'''
+    num_constraints = [len(model.Proto().constraints)] # Number of constraints after each step.
     model = create_basic_constraints(df, model, player, map_idx, players_grouped, num_cnts)
+    # The squad size constraint comes first and then the unique player constraint of each name.
+    name_constraint = {idx: num_constraints[0] + 1 + k for k, idx in enumerate(players_grouped["Name"])}
 
-    '''Comment out the constraints not required'''
-
-    '''Club'''
-    # model = create_club_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    model = create_max_club_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_min_club_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_unique_club_constraint(df, model, player, club, map_idx, players_grouped, num_cnts)
-    '''Club'''
-
-    '''League'''
-    # model = create_league_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_max_league_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_min_league_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    model = create_unique_league_constraint(df, model, player, league, map_idx, players_grouped, num_cnts)
-    '''League'''
-
-    '''Country'''
-    # model = create_country_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_max_country_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    # model = create_min_country_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    model = create_unique_country_constraint(df, model, player, country, map_idx, players_grouped, num_cnts)
-    '''Country'''
-
-    '''Rarity'''
-    # model = create_rarity_1_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    model = create_rarity_2_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    '''Rarity'''
-
-    '''Squad Rating'''
-    model = create_squad_rating_constraint_3(df, model, player, map_idx, players_grouped, num_cnts)
-    '''Squad Rating'''
-
-    '''Min Overall'''
-    # model = create_min_overall_constraint(df, model, player, map_idx, players_grouped, num_cnts)
-    '''Min Overall'''
-
-    '''Duplicates'''
-    # model = prioritize_duplicates(df, model, player)
-
-    '''Comment out the constraints not required'''
+    if constraints is None:
+        model = create_sbc_constraints(df, model, player, club, league, country, map_idx, players_grouped, num_cnts)
+    else:
+        model = create_named_constraints(constraints, df, model, player, club, league, country, map_idx, players_grouped, num_cnts)
+    num_constraints.append(len(model.Proto().constraints))
 
     '''If there is no constraint on total chemistry, simply set input.CHEMISTRY = 0'''
-    model, pos, chem_expr = create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, player, players_grouped, num_cnts, map_idx, b_c, b_l, b_n)
+    model, pos, chem_expr = create_chemistry_constraint(df, model, chem, z_club, z_league, z_nation, player, players_grouped, num_cnts, map_idx, b_c, b_l, b_n, state)
 
     '''Fix specific players and optimize the rest'''
     model = fix_players(df, model, player)
+    num_constraints.append(len(model.Proto().constraints))
 
     '''Set objective based on player cost'''
     model = set_objective(df, model, player)
 
     '''Export Model to file'''
-    # model.ExportToFile('model.txt')
+    # model.ExportToFile('model.txt') # See also input.CAPTURE_RUNS.
+    if state is not None:
+        # Constraints on groups of players (squad size, positions and the SBC constraints).
+        group_constraints = sorted(set(range(num_constraints[0], num_constraints[1])) - set(name_constraint.values()))
+        state.update({"map_idx": map_idx, "players_grouped": players_grouped, "name_constraint": name_constraint,
+                      "group_constraints": group_constraints, "num_constraints": num_constraints,
+                      "z_club": z_club, "z_league": z_league, "z_nation": z_nation})
+    return model, player, chem, pos, chem_expr
+
+def get_features(df, constraints = None):
+    '''Features of an SBC used to pick the tuned solver parameters (see tune.py).
+    constraints = None => The constraints in sbc_constraints are used.
+    '''
+    num_rows = df.shape[0]
+    if input.MINIMIZE_MAX_COST:
+        objective = "min_max_cost"
+    elif input.MAXIMIZE_TOTAL_COST:
+        objective = "max_total_cost"
+    else:
+        objective = "min_total_cost"
+    return {
+        "size": "small" if num_rows < 500 else ("medium" if num_rows < 3000 else "large"),
+        "chemistry": "none" if input.CHEMISTRY == 0 else ("low" if input.CHEMISTRY <= 20 else "high"),
+        "objective": objective,
+        "constraints": ",".join(sorted(sbc_constraints if constraints is None else constraints))
+    }
 
-    '''Solve'''
-    print("Solve Started")
+def get_tuning_classes(features):
+    '''Tuning classes of an SBC, from the most to the least specific'''
+    keys = ["size", "chemistry", "objective", "constraints"]
+    return ["|".join(f"{key}={features[key]}" for key in keys[:n]) for n in range(len(keys), 0, -1)]
+
+def get_tuned_params(features):
+    '''Solver parameters picked by tune.py for the closest tuning class (empty if none)'''
+    if not os.path.exists(input.TUNED_PARAMS_FILE):
+        return {}
+    with open(input.TUNED_PARAMS_FILE) as f:
+        tuned_params = json.load(f)
+    for tuning_class in get_tuning_classes(features):
+        if tuning_class in tuned_params:
+            print(f"Tuned solver parameters ({tuning_class}): {tuned_params[tuning_class]['params']}")
+            return tuned_params[tuning_class]["params"]
+    return {}
+
+def create_solver(max_time = 600, features = None):
+    '''Create the CP-SAT solver and set its parameters.
+    If input.USE_TUNED_PARAMS, the parameters tuned for the features of the SBC are used.
+    '''
     solver = cp_model.CpSolver()
 
     '''Solver Parameters'''
     # solver.parameters.random_seed = 42
-    solver.parameters.max_time_in_seconds = 600
+    solver.parameters.max_time_in_seconds = max_time
     # Whether the solver should log the search progress.
     solver.parameters.log_search_progress = True
     # Specify the number of parallel workers (i.e. threads) to use during search.
@@ -650,17 +973,617 @@ def SBC(df):
     # solver.parameters.cp_model_presolve = False
     # solver.parameters.stop_after_first_solution = True
     '''Solver Parameters'''
+    # Stop the search if the objective doesn't improve for X seconds (see SolutionStreamer).
+    solver.stall_time_limit = input.STALL_TIME_LIMIT
+    if input.USE_TUNED_PARAMS and features is not None:
+        set_solver_params(solver, get_tuned_params(features))
+    return solver
+
+def set_solver_params(solver, params):
+    '''Set solver parameters (e.g. the tuned ones or the ones in a challenge spec).
+    "stall_time_limit" is not a CP-SAT parameter, it's the time limit of the SolutionStreamer.
+    '''
+    for name, val in params.items():
+        if name == "stall_time_limit":
+            solver.stall_time_limit = val
+        else:
+            setattr(solver.parameters, name, val)
+
+@contextmanager
+def input_overrides(inputs, keep = ()):
+    '''Temporarily override the values in input.py.
+    The inputs in keep are also restored afterwards (e.g. if they are modified while preprocessing).
+    '''
+    unknown = [name for name in inputs if not hasattr(input, name)]
+    if unknown:
+        raise ValueError(f"Unknown inputs: {unknown}")
+    saved = {name: getattr(input, name) for name in list(inputs) + list(keep)}
+    try:
+        for name, val in inputs.items():
+            setattr(input, name, val)
+        yield
+    finally:
+        for name, val in saved.items():
+            setattr(input, name, val)
+
+def get_values(solver, variables):
+    '''Values of many variables at once, read from the solution in the solver response.
+    solver can also be a solution callback.
+    '''
+    response = solver.ResponseProto() if isinstance(solver, cp_model.CpSolver) else solver.Response()
+    solution = np.asarray(response.solution)
+    return solution[[var.Index() for var in variables]]
+
+def get_squad(df, solver, player, chem, pos, chem_expr):
+    '''Extract the selected players (row indices of the club dataset) along with
+    their Chemistry and Is_Pos, without modifying any dataframe.
+    Only the variables of the selected rows are read after the bulk read of player.
+    solver can also be a solution callback (for intermediate solutions).
+    '''
+    final_players, chemistry, is_pos = [], [], []
+    num_selected = get_values(solver, player)
+    selected = np.flatnonzero(num_selected).tolist()
+    values = get_values(solver, [chem[i] for i in selected] + [pos[i] for i in selected] + [chem_expr[i] for i in selected])
+    sel_chem, sel_pos, sel_chem_expr = np.split(values, 3)
+    multiplicity = get_multiplicity(df)
+    for k, i in enumerate(selected):
+        if multiplicity[i] > 1:
+            # Expand the class back into the cheapest individual cards.
+            for m, j in enumerate(df.at[i, "Member_Idx"][:num_selected[i]]):
+                final_players.append(j)
+                chemistry.append(int(sel_chem[k]) if m < sel_pos[k] else 0)
+                is_pos.append(1 if m < sel_pos[k] else 0)
+        else:
+            final_players.append(df.at[i, "Member_Idx"][0] if "Member_Idx" in df.columns else i)
+            chemistry.append(int(sel_chem_expr[k]))
+            is_pos.append(int(sel_pos[k]))
+    return final_players, chemistry, is_pos
+
+def get_squad_df(df_club, squad):
+    '''Dataframe of the selected players (see get_squad) with their Chemistry and Is_Pos.
+    Only the selected rows are copied, the club dataset is not modified.
+    '''
+    final_players, chemistry, is_pos = squad
+    df_out = df_club.iloc[final_players].copy()
+    df_out["Chemistry"] = chemistry
+    df_out["Is_Pos"] = is_pos # Is_Pos = 1 => Player should be placed in their respective position.
+    return df_out
+
+def get_spec(constraints = None):
+    '''Challenge spec of the current run: all the values in input.py and the named constraints'''
+    inputs = {}
+    for name, val in vars(input).items():
+        if name.isupper():
+            try:
+                inputs[name] = json.loads(json.dumps(val))
+            except TypeError: # Not a json value.
+                continue
+    return {"inputs": inputs, "constraints": list(sbc_constraints if constraints is None else constraints)}
+
+def get_club_hash(df_club):
+    '''Hash of the preprocessed club dataset'''
+    return hashlib.sha256(pd.util.hash_pandas_object(df_club, index = True).values.tobytes()).hexdigest()
+
+def capture_run(df_club, model, solver, status, trajectory, spec, tag, capture_dir = None):
+    '''Save a run into capture_dir (default: input.CAPTURE_DIR) so that it can be solved again with replay.py.
+    Saved: The model (model.txt), the solver parameters (params.txt), the challenge spec,
+    the hash of the club dataset and the trajectory of the improving solutions (run.json).
+    '''
+    club_hash = get_club_hash(df_club)
+    path = os.path.join(capture_dir or input.CAPTURE_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{club_hash[:8]}_{tag}")
+    k = 1
+    while os.path.exists(path if k == 1 else f"{path}_{k}"):
+        k += 1
+    path = path if k == 1 else f"{path}_{k}"
+    os.makedirs(path)
+    model.ExportToFile(os.path.join(path, "model.txt"))
+    with open(os.path.join(path, "params.txt"), "w") as f:
+        f.write(str(solver.parameters))
+    found = status == 2 or status == 4 # Feasible or Optimal
+    run = {
+        "tag": tag,
+        "spec": spec,
+        "club_hash": club_hash,
+        "num_rows": df_club.shape[0],
+        "ortools_version": ortools.__version__,
+        "status": solver.StatusName(status),
+        "objective": solver.ObjectiveValue() if found else None,
+        "bound": solver.BestObjectiveBound() if found else None,
+        "wall_time": solver.WallTime(),
+        "trajectory": trajectory
+    }
+    with open(os.path.join(path, "run.json"), "w") as f:
+        json.dump(run, f, indent = 4)
+    print(f"Run captured in {path}")
 
-    status = solver.Solve(model, ObjectiveEarlyStopping(timer_limit = 60))
+def solve_model(df_club, model, solver, tag = "sbc", constraints = None):
+    '''Solve the model with early stopping.
+    If input.CAPTURE_RUNS, the run is captured (see capture_run).
+    '''
+    trajectory = []
+    def on_solution(callback):
+        trajectory.append({"wall_time": callback.WallTime(), "objective": callback.ObjectiveValue(),
+                           "bound": callback.BestObjectiveBound()})
+    early_stopping = SolutionStreamer(solver.stall_time_limit, on_solution)
+    status = solver.Solve(model, early_stopping)
+    early_stopping.cancel_timer()
+    if input.CAPTURE_RUNS:
+        capture_run(df_club, model, solver, status, trajectory, get_spec(constraints), tag)
+    return status
+
+@runtime
+def SBC(df):
+    '''Optimize SBC using Constraint Integer Programming.
+    Returns a dataframe of the selected players (None if no squad was found).
+    '''
+    df_club = df
+    if input.USE_MULTIPLICITY_ENCODING:
+        df = group_interchangeable_cards(df_club)
+
+    compress = input.COMPRESS_COST and not (input.MINIMIZE_MAX_COST or input.MAXIMIZE_TOTAL_COST)
+    if compress:
+        df_comp, scale = compress_cost(df)
+        model, player, chem, pos, chem_expr = create_model(df_comp)
+    else:
+        model, player, chem, pos, chem_expr = create_model(df)
+
+    '''Solve'''
+    print("Solve Started")
+    solver = create_solver(features = get_features(df))
+    status = solve_model(df_club, model, solver)
     print(input.status_dict[status])
     print('\n')
-    final_players = []
-    if status == 2 or status == 4: # Feasible or Optimal
-        df['Chemistry'] = 0
-        df['Is_Pos'] = 0 # Is_Pos = 1 => Player should be placed in their respective position.
-        for i in range(num_cnts[0]):
-            if solver.Value(player[i]) == 1:
-                final_players.append(i)
-                df.loc[i, "Chemistry"] = solver.Value(chem_expr[i])
-                df.loc[i, "Is_Pos"] = solver.Value(pos[i])
-    return final_players
+    if status != 2 and status != 4: # Neither Feasible nor Optimal
+        return None
+    squad = get_squad(df, solver, player, chem, pos, chem_expr)
+
+    if compress:
+        bound = solver.BestObjectiveBound() * scale
+        report_cost_gap(df_club, squad[0], bound)
+        if input.POLISH_COST:
+            '''Polish with the exact prices, starting from the compressed solution'''
+            print("Polish Started")
+            model = set_objective(df, model, player)
+            model.ClearHints()
+            for p, val in zip(player, get_values(solver, player).tolist()):
+                model.AddHint(p, val)
+            solver = create_solver(max_time = input.POLISH_TIME_LIMIT, features = get_features(df))
+            status = solve_model(df_club, model, solver, tag = "polish")
+            print(input.status_dict[status])
+            print('\n')
+            exact_bound = 0
+            if status == 2 or status == 4: # Feasible or Optimal
+                exact_bound = solver.BestObjectiveBound()
+                polished = get_squad(df, solver, player, chem, pos, chem_expr)
+                if df_club["Cost"].iloc[polished[0]].sum() <= df_club["Cost"].iloc[squad[0]].sum():
+                    squad = polished
+            report_cost_gap(df_club, squad[0], bound, exact_bound)
+    return get_squad_df(df_club, squad)
+
+def SBC_stream(df, constraints = None, stop = None):
+    '''Yield every improving squad while the solver runs in a background thread.
+    Each squad is a dict with the selected players (row indices of df), their
+    chemistry and Is_Pos, the cost, total chemistry, squad rating, objective and
+    the current objective bound. Stop iterating (or call close()) to cancel the
+    rest of the search. The final solver status is the return value of the generator.
+    stop => Optional threading.Event that cancels the search from another thread
+    (e.g. while it is waiting for the next squad, see SBC_stream_async).
+    '''
+    stop = stop or threading.Event()
+    df_club = df
+    if input.USE_MULTIPLICITY_ENCODING:
+        df = group_interchangeable_cards(df_club)
+
+    model, player, chem, pos, chem_expr = create_model(df, constraints)
+    if stop.is_set():
+        return 0
+
+    squads = queue.Queue()
+    trajectory = []
+    def on_solution(callback):
+        trajectory.append({"wall_time": callback.WallTime(), "objective": callback.ObjectiveValue(),
+                           "bound": callback.BestObjectiveBound()})
+        final_players, chemistry, is_pos = get_squad(df, callback, player, chem, pos, chem_expr)
+        squads.put({
+            "players": final_players, "player_chemistry": chemistry, "is_pos": is_pos,
+            "cost": int(df_club["Cost"].iloc[final_players].sum()), "chemistry": sum(chemistry),
+            "rating": input.calc_squad_rating(df_club["Rating"].iloc[final_players].tolist()),
+            "objective": callback.ObjectiveValue(), "bound": callback.BestObjectiveBound(),
+            "wall_time": callback.WallTime()
+        })
+
+    print("Solve Started")
+    solver = create_solver(features = get_features(df, constraints))
+    streamer = SolutionStreamer(solver.stall_time_limit, on_solution)
+    status = 0
+    spec = get_spec(constraints) if input.CAPTURE_RUNS else None
+    capture_dir = input.CAPTURE_DIR # Read now, the solve runs in the background.
+    search_done = threading.Event()
+    def solve():
+        nonlocal status
+        try:
+            if not stop.is_set():
+                status = solver.Solve(model, streamer)
+                print(input.status_dict[status])
+                if spec:
+                    capture_run(df_club, model, solver, status, trajectory, spec, "stream", capture_dir)
+        finally:
+            streamer.cancel_timer()
+            search_done.set()
+            squads.put(None) # The search is over.
+    def stop_if_requested():
+        # A StopSearch sent right before Solve starts is lost, so stop is checked until the search is over.
+        while not search_done.wait(0.1):
+            if stop.is_set():
+                solver.StopSearch()
+    thread = threading.Thread(target = solve, daemon = True)
+    thread.start()
+    threading.Thread(target = stop_if_requested, daemon = True).start()
+    try:
+        while True:
+            squad = squads.get()
+            if squad is None:
+                break
+            yield squad
+    finally:
+        stop.set()
+        solver.StopSearch()
+        thread.join()
+    return status
+
+async def SBC_stream_async(df, constraints = None):
+    '''Async iterator version of SBC_stream (the model is also created in a background thread).
+    Cancelling the consuming task cancels the rest of the search.
+    '''
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    stream = SBC_stream(df, constraints, stop)
+    pending = None # next(stream) running in the executor.
+    try:
+        while True:
+            pending = loop.run_in_executor(None, next, stream, None)
+            # Shielded, so that a cancelled task can still wait for next(stream) to return.
+            squad = await asyncio.shield(pending)
+            pending = None
+            if squad is None:
+                break
+            yield squad
+    finally:
+        # The generator can't be closed while next(stream) is running, so the search is stopped first.
+        stop.set()
+        if pending is not None:
+            await asyncio.wait([pending])
+        await loop.run_in_executor(None, stream.close)
+
+@runtime
+def SBC_alternatives(df):
+    '''Find up to input.NUM_SQUADS alternative squads in one session.
+    After each solve, a no-good cut allowing at most input.MAX_OVERLAP cards of the
+    squad to be reused is added to the same model and the squad is passed as a hint.
+    With input.MAX_OVERLAP = input.NUM_PLAYERS - 1, this gives the K cheapest distinct squads
+    if every solve is optimal (a warning is printed otherwise).
+    The whole search is limited to input.ALTERNATIVES_TIME_LIMIT seconds.
+    Returns a list of squads, each one a dataframe of the selected players.
+    '''
+    df_club = df
+    if input.USE_MULTIPLICITY_ENCODING:
+        df = group_interchangeable_cards(df_club)
+
+    model, player, chem, pos, chem_expr = create_model(df)
+
+    squads = []
+    deadline = time.time() + input.ALTERNATIVES_TIME_LIMIT
+    while len(squads) < input.NUM_SQUADS:
+        time_left = deadline - time.time()
+        if time_left <= 0:
+            print("**Time limit reached for alternative squads!**")
+            break
+        print(f"Solve Started (Squad {len(squads) + 1})")
+        solver = create_solver(max_time = min(600, time_left), features = get_features(df))
+        status = solve_model(df_club, model, solver, tag = f"squad_{len(squads) + 1}")
+        print(input.status_dict[status])
+        print('\n')
+        if status != 2 and status != 4: # Neither Feasible nor Optimal
+            break
+        if status != 4:
+            print(f"**Squad {len(squads) + 1} is not optimal, so cheaper squads may have been missed!**")
+        squads.append(get_squad_df(df_club, get_squad(df, solver, player, chem, pos, chem_expr)))
+        squad = get_values(solver, player).tolist()
+        model = create_overlap_constraint(df, model, player, squad, input.MAX_OVERLAP)
+        model.ClearHints()
+        for p, val in zip(player, squad):
+            model.AddHint(p, val)
+    return squads
+
+@runtime
+def SBC_lexicographic(df):
+    '''Optimize the objectives in input.LEXICOGRAPHIC_OBJECTIVES one after the other.
+    After each stage, its optimal value is fixed as a constraint and its solution is
+    passed as a hint to the next stage, so every stage is exact for its own objective
+    (unless it hits the time limit, in which case its best value found is fixed instead).
+    Returns a dataframe of the selected players (None if no squad was found).
+    '''
+    df_club = df
+    if input.USE_MULTIPLICITY_ENCODING:
+        df = group_interchangeable_cards(df_club)
+
+    model, player, chem, pos, chem_expr = create_model(df)
+
+    squad = None
+    for k, stage in enumerate(input.LEXICOGRAPHIC_OBJECTIVES):
+        print(f"Solve Started (Stage {k + 1}: {stage})")
+        expr, maximize = create_stage_objective(df, model, player, stage)
+        if maximize:
+            model.Maximize(expr)
+        else:
+            model.Minimize(expr)
+        solver = create_solver(max_time = input.STAGE_TIME_LIMIT, features = get_features(df))
+        status = solve_model(df_club, model, solver, tag = f"stage_{k + 1}")
+        print(input.status_dict[status])
+        print('\n')
+        if status != 2 and status != 4: # Neither Feasible nor Optimal
+            break
+        squad = get_squad(df, solver, player, chem, pos, chem_expr)
+        value = int(round(solver.ObjectiveValue()))
+        print(f"Stage {k + 1} ({stage}): {value}")
+        if status != 4:
+            print(f"**Stage {k + 1} is not optimal, so its best value found is fixed instead!**")
+        '''Fix the value of this stage and warm-start the next one from its solution'''
+        if maximize:
+            model.Add(expr >= value)
+        else:
+            model.Add(expr <= value)
+        model.ClearHints()
+        for i, val in enumerate(solver.ResponseProto().solution):
+            model.AddHint(model.GetIntVarFromProtoIndex(i), val)
+    if squad is None:
+        return None
+    return get_squad_df(df_club, squad)
+
+def get_nonlinear_vars(ct):
+    '''Variables (or literals) of a constraint that isn't linear (see SBCSession)'''
+    if ct.has_lin_max() or ct.has_int_prod() or ct.has_int_div() or ct.has_int_mod():
+        args = ct.lin_max if ct.has_lin_max() else (ct.int_prod if ct.has_int_prod() else (ct.int_div if ct.has_int_div() else ct.int_mod))
+        return [v for expr in list(args.exprs) + [args.target] for v in expr.vars]
+    for name in ["bool_or", "bool_and", "at_most_one", "exactly_one", "bool_xor"]:
+        if getattr(ct, f"has_{name}")():
+            return list(getattr(ct, name).literals)
+    if ct.has_element():
+        return list(ct.element.vars) + [v for expr in ct.element.exprs for v in expr.vars] + list(ct.element.linear_index.vars) + list(ct.element.linear_target.vars)
+    return list(ct.enforcement_literal)
+
+class SBCSession:
+    '''Long-lived solver session for a club that changes between runs.
+    The preprocessed club and the CP-SAT model are kept in memory. Cards that are
+    gone (used in another SBC, sold, etc.) are fixed to 0 in the existing model.
+    Added cards (e.g. from new packs) get their own variables, which are appended to
+    the linear constraints of the existing model (see _extend_model). The model is
+    only rebuilt from memory before the next solve if that can't be done: with the
+    multiplicity encoding, constraints that aren't linear in the players
+    (squad_rating_2, MINIMIZE_MAX_COST), cards that change the count of duplicates
+    (USE_ALL_DUPLICATES, USE_AT_LEAST_HALF_DUPLICATES), cards with a Club, League,
+    Country, Position, Rating, Color or Rarity that isn't there in the model yet
+    (the model has no variables for it) or cards that don't fit the groups of a
+    constraint (e.g. a constraint on a Club whose cards all have the same Rating and
+    a new card of that Club with another Rating).
+    The previous squad is always passed to the solver as a hint.
+    '''
+    def __init__(self, df):
+        self.df_club = df
+        self.squad = [] # Rows of df_club in the previous squad.
+        self._removed = set() # Rows of df_club removed since the model was built.
+        self._build()
+
+    @runtime
+    def _build(self):
+        self.df = group_interchangeable_cards(self.df_club) if input.USE_MULTIPLICITY_ENCODING else self.df_club
+        state = {}
+        self.model, self.player, self.chem, self.pos, self.chem_expr = create_model(self.df, state = state)
+        self._model_row = {} # Row of df_club => Row of df (i.e. index of player).
+        if "Member_Idx" in self.df.columns:
+            for i, members in enumerate(self.df["Member_Idx"]):
+                for j in members:
+                    self._model_row[j] = i
+        else:
+            self._model_row = {i: i for i in range(self.df.shape[0])}
+        self._rebuild = False
+
+        '''Needed to extend the model with new cards (see _extend_model)'''
+        self._state = state
+        self._name_constraint = {name: state["name_constraint"][idx] for name, idx in state["map_idx"]["Name"].items()
+                                 if idx in state["name_constraint"]}
+        if "Member_Idx" not in self.df.columns:
+            self._index_group_constraints()
+
+    def _index_group_constraints(self):
+        '''Find the groups of players (e.g. the players of a Club or the Rare Gold players) that each
+        linear constraint in state["group_constraints"] is made of, along with the coefficient of each group.
+        A constraint can be explained by several fields if their groups have the same players
+        (e.g. a Club with only one Rating). field = None => Same coefficient for all the players.
+        '''
+        df, proto, state = self.df, self.model.Proto(), self._state
+        self._fields = ["Club", "League", "Country", "Position", "Rating", "Color", "Rarity"]
+        if "IsDuplicate" in df.columns:
+            self._fields.append("IsDuplicate")
+        self._values = {field: df[field].tolist() for field in self._fields}
+        self._fields.append("Color_Rarity") # For create_rarity_1_constraint.
+        self._values["Color_Rarity"] = list(zip(df["Color"], df["Rarity"]))
+        group_size = {field: pd.Series(vals).value_counts().to_dict() for field, vals in self._values.items()}
+        self._seen = {field: set(sizes) for field, sizes in group_size.items()}
+        row_of = {p.Index(): i for i, p in enumerate(self.player)}
+        uses_players = lambda ct: any((v if v >= 0 else -v - 1) in row_of for v in get_nonlinear_vars(ct))
+
+        self._extendable = True
+        self._groups = {} # Constraint => [(field, {value: coefficient})]
+        self._group_index = {} # (field, value) => Constraints with players from the group.
+        for k in state["group_constraints"]:
+            ct = proto.constraints[k]
+            if not ct.has_linear():
+                if uses_players(ct):
+                    self._extendable = False # e.g. create_squad_rating_constraint_2.
+                continue
+            terms = [(row_of[v], coeff) for v, coeff in zip(ct.linear.vars, ct.linear.coeffs) if v in row_of]
+            if not terms:
+                continue
+            explained = []
+            for field in ([None] if len(terms) == len(self.player) else []) + self._fields:
+                coeffs = {}
+                for i, coeff in terms:
+                    if coeffs.setdefault(None if field is None else self._values[field][i], coeff) != coeff:
+                        break
+                else:
+                    if field is None or sum(group_size[field][val] for val in coeffs) == len(terms):
+                        explained.append((field, coeffs))
+            if not explained:
+                self._extendable = False
+            self._groups[k] = explained
+            for field, coeffs in explained:
+                for val in coeffs:
+                    self._group_index.setdefault((field, val), []).append(k)
+        # Objective with constraints (e.g. MINIMIZE_MAX_COST).
+        for ct in list(proto.constraints)[state["num_constraints"][2]:]:
+            if not ct.has_linear() and uses_players(ct):
+                self._extendable = False
+
+    def remove_players(self, row_ids):
+        '''Remove cards using their Row_ID (starts from 2) in the club dataset'''
+        idxes = list(self.df_club[self.df_club["Original_Idx"].isin([(idx - 2) for idx in row_ids])].index)
+        multiplicity = get_multiplicity(self.df)
+        for j in idxes:
+            if j in self._removed:
+                continue
+            self._removed.add(j)
+            i = self._model_row.get(j)
+            if i is None: # Added after the model was built.
+                continue
+            if multiplicity[i] > 1:
+                # The cost of the class depends on its members, so it has to be rebuilt.
+                self._rebuild = True
+            else:
+                self.model.Add(self.player[i] == 0)
+        self.squad = [j for j in self.squad if j not in self._removed]
+        print(f"Removed {len(idxes)} rows from the club")
+
+    def add_players(self, df_new):
+        '''Add preprocessed cards to the club.
+        They get Row_IDs as if they were appended at the end of the club dataset.
+        '''
+        df_new = df_new.copy()
+        df_new["Original_Idx"] = df_new["Original_Idx"] - df_new["Original_Idx"].min() + self.df_club["Original_Idx"].max() + 1
+        start = self.df_club.shape[0]
+        self.df_club = pd.concat([self.df_club, df_new], ignore_index = True)
+        if not self._rebuild and not self._extend_model(start):
+            print("**The model will be rebuilt for the added cards**")
+            self._rebuild = True
+        print(f"Added {df_new.shape[0]} rows to the club")
+
+    def _extend_model(self, start):
+        '''Append the cards of df_club (from row start) to the existing model.
+        Each card gets its own variables, and its terms are appended to the existing
+        constraints of its groups (see _index_group_constraints), to the chemistry
+        constraints of its Club, League and Country, to its unique player constraint and
+        to the objective. Returns False (without changing the model) if that can't be done.
+        '''
+        if "Member_Idx" in self.df.columns or not self._extendable:
+            return False
+        df_new = self.df_club.iloc[start:]
+        if (input.USE_ALL_DUPLICATES or input.USE_AT_LEAST_HALF_DUPLICATES) and "IsDuplicate" in df_new.columns and df_new["IsDuplicate"].any():
+            return False # The number of duplicates that has to be used depends on the club.
+
+        '''Terms of the new cards in the group constraints'''
+        new_terms = []
+        for j in range(start, self.df_club.shape[0]):
+            vals = {field: self.df_club.at[j, field] for field in self._fields if field != "Color_Rarity"}
+            vals["Color_Rarity"] = (vals["Color"], vals["Rarity"])
+            if any(vals[field] not in self._seen[field] for field in self._fields):
+                return False # New groups need new variables (e.g. the chemistry of a new Club).
+            vals[None] = None
+            terms = []
+            for k in set(k for field in [None] + self._fields for k in self._group_index.get((field, vals[field]), [])):
+                coeffs = set(group.get(vals[field], 0) for field, group in self._groups[k])
+                if len(coeffs) > 1:
+                    return False # The fields explaining the constraint don't agree for this card.
+                if coeffs != {0}:
+                    terms.append((k, coeffs.pop()))
+            new_terms.append(terms)
+
+        self.df = self.df_club
+        proto = self.model.Proto()
+        sign = -1 if proto.objective.scaling_factor < 0 else 1 # Maximize => The objective is negated.
+        state = self._state
+        map_idx, chem_constraints = state["map_idx"], state["chem_constraints"]
+        formation_list = input.formation_dict[input.FORMATION]
+        for j, terms in zip(range(start, self.df_club.shape[0]), new_terms):
+            player_j = self.model.NewBoolVar(f"player{j}")
+            chem_j = self.model.NewIntVar(0, 3, f"chem{j}")
+            pos_j, in_pos_j, chem_expr_j = create_player_chemistry(self.df, self.model, j, player_j, chem_j, 1,
+                                                                   state["z_club"], state["z_league"], state["z_nation"], map_idx)
+            p_club, p_league, p_nation, p_pos, rarity = (self.df.at[j, field] for field in ["Club", "League", "Country", "Position", "Rarity"])
+            in_pos_terms = []
+            if p_pos in formation_list:
+                if p_pos in chem_constraints["Position"]:
+                    in_pos_terms.append((chem_constraints["Position"][p_pos], 1))
+                weight = get_chem_weight("Club", rarity)
+                if weight:
+                    in_pos_terms += [(k, weight) for k in chem_constraints["Club"][map_idx["Club"][p_club]]]
+                leagues = chem_constraints["League"] if rarity == "Icon" else [map_idx["League"][p_league]] # Icons count towards every League.
+                in_pos_terms += [(k, get_chem_weight("League", rarity)) for l in leagues for k in chem_constraints["League"][l]]
+                in_pos_terms += [(k, get_chem_weight("Country", rarity)) for k in chem_constraints["Country"][map_idx["Country"][p_nation]]]
+            name = self.df.at[j, "Name"]
+            if name in self._name_constraint:
+                terms.append((self._name_constraint[name], 1))
+            else:
+                self._name_constraint[name] = self.model.Add(player_j <= 1).Index()
+            for var, var_terms in [(player_j, terms), (in_pos_j, in_pos_terms), (chem_expr_j, [(chem_constraints["Total"], 1)])]:
+                for k, coeff in var_terms:
+                    proto.constraints[k].linear.vars.append(var.Index())
+                    proto.constraints[k].linear.coeffs.append(coeff)
+            proto.objective.vars.append(player_j.Index())
+            proto.objective.coeffs.append(sign * int(self.df.at[j, "Cost"]))
+
+            for field in ["Club", "League", "Country", "Position", "Rating", "Color", "Rarity"]:
+                group = state["players_grouped"][field].setdefault(map_idx[field][self.df.at[j, field]], [])
+                group.append(player_j)
+            for field in self._fields:
+                val = (self.df.at[j, "Color"], self.df.at[j, "Rarity"]) if field == "Color_Rarity" else self.df.at[j, field]
+                self._values[field].append(val)
+            self.player.append(player_j)
+            self.chem.append(chem_j)
+            self.pos.append(pos_j)
+            self.chem_expr.append(chem_expr_j)
+            self._model_row[j] = j
+        return True
+
+    def _apply_delta(self):
+        '''Drop the removed rows and rebuild the model from the in-memory club'''
+        kept = self.df_club.index.difference(sorted(self._removed))
+        new_row = dict(zip(kept, range(len(kept))))
+        self.squad = [new_row[j] for j in self.squad if j in new_row]
+        self.df_club = self.df_club.loc[kept].reset_index(drop = True)
+        self._removed = set()
+        self._build()
+
+    @runtime
+    def solve(self):
+        '''Solve the SBC for the current club, starting from the previous squad.
+        Returns a dataframe of the selected players (None if no squad was found).
+        '''
+        if self._rebuild:
+            self._apply_delta()
+        self.model.ClearHints()
+        hint = [0] * len(self.player)
+        for j in self.squad:
+            hint[self._model_row[j]] += 1
+        for p, val in zip(self.player, hint):
+            self.model.AddHint(p, val)
+
+        print("Solve Started")
+        solver = create_solver(features = get_features(self.df))
+        status = solve_model(self.df_club, self.model, solver, tag = "session")
+        print(input.status_dict[status])
+        print('\n')
+        if status != 2 and status != 4: # Neither Feasible nor Optimal
+            return None
+        squad = get_squad(self.df, solver, self.player, self.chem, self.pos, self.chem_expr)
+        self.squad = squad[0]
+        return get_squad_df(self.df_club, squad)
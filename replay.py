@@ -0,0 +1,92 @@
+'''Replay captured runs (see input.CAPTURE_RUNS).
+
+Solves the captured models again with their captured solver parameters. Neither
+the club dataset nor input.py is needed, so the worst instances can be collected
+and used to profile changes to the model or the solver parameters.
+
+Run: py replay.py captures                       # Every capture in the folder.
+     py replay.py captures/20261019_101500_1a2b3c4d_sbc --time 60
+     py replay.py captures --params "num_search_workers: 8, linearization_level: 2"
+     py replay.py captures --out replay.jsonl     # Also save the results.
+'''
+import argparse
+import json
+import os
+from ortools.sat.python import cp_model
+
+def find_captures(paths):
+    '''Capture folders in paths (a path can be a capture or a folder of captures)'''
+    captures = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, "run.json")):
+            captures.append(path)
+        else:
+            captures.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                   if os.path.exists(os.path.join(path, name, "run.json"))))
+    return captures
+
+def load_capture(path):
+    '''Model, solver and captured run of a capture folder'''
+    with open(os.path.join(path, "run.json")) as f:
+        run = json.load(f)
+    model = cp_model.CpModel()
+    with open(os.path.join(path, "model.txt")) as f:
+        model.Proto().parse_text_format(f.read())
+    solver = cp_model.CpSolver()
+    with open(os.path.join(path, "params.txt")) as f:
+        solver.parameters.parse_text_format(f.read())
+    return model, solver, run
+
+def replay(path, max_time = None, params = "", seed = None, log = False):
+    '''Solve a captured run again. Returns the result along with the captured one.'''
+    model, solver, run = load_capture(path)
+    if max_time is not None:
+        solver.parameters.max_time_in_seconds = max_time
+    if seed is not None:
+        solver.parameters.random_seed = seed
+    solver.parameters.merge_text_format(params)
+    solver.parameters.log_search_progress = log
+
+    trajectory = []
+    class Recorder(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self):
+            trajectory.append({"wall_time": self.WallTime(), "objective": self.ObjectiveValue(),
+                               "bound": self.BestObjectiveBound()})
+    status = solver.Solve(model, Recorder())
+    found = status == 2 or status == 4 # Feasible or Optimal
+    captured_trajectory = run["trajectory"]
+    return {
+        "capture": path,
+        "club_hash": run["club_hash"],
+        "captured_status": run["status"],
+        "captured_objective": run["objective"],
+        "captured_time_to_best": captured_trajectory[-1]["wall_time"] if captured_trajectory else None,
+        "captured_wall_time": run["wall_time"],
+        "status": solver.StatusName(status),
+        "objective": solver.ObjectiveValue() if found else None,
+        "bound": solver.BestObjectiveBound() if found else None,
+        "time_to_best": trajectory[-1]["wall_time"] if trajectory else None,
+        "wall_time": solver.WallTime(),
+        "params": params,
+        "trajectory": trajectory
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Solve captured runs again")
+    parser.add_argument("paths", nargs = "+", help = "Capture folders (or folders of captures)")
+    parser.add_argument("--time", type = float, help = "Time limit (in seconds). Default: The captured one")
+    parser.add_argument("--params", default = "", help = "Solver parameters (text format) merged into the captured ones")
+    parser.add_argument("--seed", type = int, help = "Random seed")
+    parser.add_argument("--log", action = "store_true", help = "Log the search progress")
+    parser.add_argument("--out", help = "Append the results to this file (one json per line)")
+    args = parser.parse_args()
+    for path in find_captures(args.paths):
+        result = replay(path, args.time, args.params, args.seed, args.log)
+        print(f"{path}")
+        print(f"    Captured: {result['captured_status']}, Objective: {result['captured_objective']}, "
+              f"Time to best: {result['captured_time_to_best']}, Wall time: {result['captured_wall_time']:.2f}")
+        print(f"    Replayed: {result['status']}, Objective: {result['objective']}, "
+              f"Time to best: {result['time_to_best']}, Wall time: {result['wall_time']:.2f}")
+        if args.out:
+            with open(args.out, "a") as f:
+                f.write(json.dumps(result) + "\n")
@@ -0,0 +1,304 @@
+'''Local solve server.
+
+Keeps the preprocessed club datasets in memory and solves challenge specs as jobs
+on a bounded pool of worker threads. Every improving solution found by the solver
+is streamed to the clients as soon as it is found. Only listens on localhost.
+
+Run: py server.py --port 8765 --workers 2 --club "Frederik FC_24.csv"
+
+POST   /jobs              Submit a challenge spec. Returns {"job_id": X}.
+GET    /jobs              Status of all the jobs.
+GET    /jobs/X            Status of job X along with its best squad so far.
+GET    /jobs/X/events     Stream the events of job X (one JSON per line).
+DELETE /jobs/X            Cancel job X (queued or running).
+
+Challenge spec:
+{
+    "dataset": "Frederik FC_24.csv",
+    "inputs": {"FORMATION": "4-4-2", "SQUAD_RATING": 80, "CHEMISTRY": 31}, # Overrides the values in input.py.
+    "constraints": ["max_club", "unique_league", "squad_rating_3"], # Optional. See optimize.named_constraints.
+    "max_time": 600, # Optional.
+    "solver": {"num_search_workers": 8, "stall_time_limit": 30} # Optional. Overrides the solver parameters.
+}
+
+Example: curl -N localhost:8765/jobs/1/events
+'''
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import input
+import main
+import optimize
+
+HOST = "127.0.0.1"
+
+# These inputs are used while preprocessing the club dataset.
+# Note: preprocess_data_2 modifies input.REMOVE_PLAYERS.
+PREPROCESS_INPUTS = ["REMOVE_PLAYERS", "USE_PREFERRED_POSITION", "USE_ALTERNATE_POSITIONS"]
+
+# How often (in seconds) a running job checks if it was cancelled (see stop_if_cancelled).
+CANCEL_POLL_INTERVAL = 0.5
+
+def squad_event(event_type, df_club, squad):
+    '''Summary of a squad (see optimize.get_squad) that can be sent to the clients'''
+    final_players, chemistry, is_pos = squad
+    df_out = df_club.iloc[final_players]
+    players = [
+        {"Name": str(name), "Position": str(pos), "Rating": int(rat), "Cost": int(cost),
+         "Chemistry": int(chem), "Is_Pos": int(in_pos), "Org_Row_ID": int(idx) + 2}
+        for name, pos, rat, cost, chem, in_pos, idx in zip(
+            df_out["Name"], df_out["Position"], df_out["Rating"], df_out["Cost"],
+            chemistry, is_pos, df_out["Original_Idx"])
+    ]
+    return {
+        "type": event_type,
+        "cost": int(df_out["Cost"].sum()),
+        "chemistry": int(sum(chemistry)),
+        "rating": input.calc_squad_rating(df_out["Rating"].tolist()),
+        "squad": players
+    }
+
+def validate_spec(spec):
+    '''Raise a ValueError if the challenge spec is not valid (see the top of the file)'''
+    if not isinstance(spec, dict):
+        raise ValueError("The challenge spec must be a JSON object")
+    if "dataset" not in spec:
+        raise ValueError("The challenge spec needs a dataset")
+    for key in ["inputs", "solver"]:
+        if not isinstance(spec.get(key, {}), dict):
+            raise ValueError(f"{key} must be a JSON object")
+    unknown = [name for name in spec.get("inputs", {}) if not hasattr(input, name)]
+    if unknown:
+        raise ValueError(f"Unknown inputs: {unknown}")
+    constraints = spec.get("constraints") or [] # None => The default constraints.
+    if not isinstance(constraints, list):
+        raise ValueError("constraints must be a list of constraint names")
+    unknown = [name for name in constraints if not isinstance(name, str) or name not in optimize.named_constraints]
+    if unknown:
+        raise ValueError(f"Unknown constraints: {unknown}")
+
+class Job:
+    def __init__(self, job_id, spec):
+        self.job_id = job_id
+        self.spec = spec
+        self.status = "QUEUED"
+        self.events = []
+        self.best = None # Last squad event.
+        self.finished = False
+        self.cancel_requested = False
+        self.solver = None
+        self.changed = asyncio.Event() # Set (and replaced) every time an event is published.
+
+    def summary(self):
+        return {"job_id": self.job_id, "status": self.status, "best": self.best}
+
+class SolveServer:
+    def __init__(self, workers, max_queue):
+        self.jobs = {}
+        self.clubs = {} # Preprocessed club datasets.
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        # input.py is shared by all the jobs, so the models are built one at a time.
+        # The solves themselves run in parallel.
+        self.build_lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.loop = None
+
+    def load_club(self, dataset):
+        '''Preprocessed club dataset (cached in memory)'''
+        key = (dataset, json.dumps([getattr(input, name) for name in PREPROCESS_INPUTS]))
+        if key not in self.clubs:
+            df = pd.read_csv(dataset, index_col = False)
+            self.clubs[key] = main.preprocess_data_2(df)
+        return self.clubs[key]
+
+    def submit(self, spec):
+        validate_spec(spec)
+        num_queued = sum(job.status == "QUEUED" for job in self.jobs.values())
+        if num_queued >= self.max_queue:
+            return None
+        job = Job(next(self.job_ids), spec)
+        self.jobs[job.job_id] = job
+        self.loop.run_in_executor(self.executor, self.run_job, job)
+        return job
+
+    def cancel(self, job):
+        job.cancel_requested = True
+        if job.status == "QUEUED":
+            # Frees its place in the queue right away. The worker skips it later.
+            self._publish(job, {"type": "done", "status": "CANCELLED"})
+        elif job.solver:
+            job.solver.StopSearch()
+
+    def emit(self, job, event):
+        '''Publish an event from a worker thread'''
+        self.loop.call_soon_threadsafe(self._publish, job, event)
+
+    def _publish(self, job, event):
+        if job.finished: # e.g. The worker started a job that was cancelled while queued.
+            return
+        job.events.append(event)
+        if event["type"] in ["solution", "done"] and "squad" in event:
+            job.best = event
+        if event["type"] in ["status", "done"]:
+            job.status = event["status"]
+        if event["type"] == "done":
+            job.finished = True
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
+
+    def run_job(self, job):
+        '''Build and solve the model of a job (runs in a worker thread)'''
+        if job.cancel_requested:
+            self.emit(job, {"type": "done", "status": "CANCELLED"})
+            return
+        self.emit(job, {"type": "status", "status": "RUNNING"})
+        try:
+            spec = job.spec
+            with self.build_lock, optimize.input_overrides(spec.get("inputs", {}), keep = PREPROCESS_INPUTS):
+                df_club = self.load_club(spec["dataset"])
+                df = optimize.group_interchangeable_cards(df_club) if input.USE_MULTIPLICITY_ENCODING else df_club
+                model, player, chem, pos, chem_expr = optimize.create_model(df, spec.get("constraints"))
+                features = optimize.get_features(df, spec.get("constraints"))
+                capture_spec = optimize.get_spec(spec.get("constraints")) if input.CAPTURE_RUNS else None
+                capture_dir = input.CAPTURE_DIR
+                # The tuned parameters depend on the overridden inputs (e.g. USE_TUNED_PARAMS).
+                solver = optimize.create_solver(max_time = spec.get("max_time", 600), features = features)
+            optimize.set_solver_params(solver, spec.get("solver", {}))
+
+            trajectory = []
+            def on_solution(callback):
+                if job.cancel_requested:
+                    callback.cancel_search()
+                trajectory.append({"wall_time": callback.WallTime(), "objective": callback.ObjectiveValue(),
+                                   "bound": callback.BestObjectiveBound()})
+                squad = optimize.get_squad(df, callback, player, chem, pos, chem_expr)
+                event = squad_event("solution", df_club, squad)
+                event.update({"objective": callback.ObjectiveValue(), "bound": callback.BestObjectiveBound(),
+                              "wall_time": callback.WallTime()})
+                self.emit(job, event)
+
+            streamer = optimize.SolutionStreamer(solver.stall_time_limit, on_solution)
+            job.solver = solver
+            solve_done = threading.Event()
+            threading.Thread(target = stop_if_cancelled, args = (job, solver, solve_done), daemon = True).start()
+            status = solver.Solve(model, streamer) if not job.cancel_requested else 0
+            solve_done.set()
+            streamer.cancel_timer()
+            if capture_spec and not job.cancel_requested:
+                optimize.capture_run(df_club, model, solver, status, trajectory, capture_spec, f"job_{job.job_id}", capture_dir)
+            event = {"type": "done", "status": "CANCELLED" if job.cancel_requested else solver.StatusName(status)}
+            if status == 2 or status == 4: # Feasible or Optimal
+                event.update(squad_event("done", df_club, optimize.get_squad(df, solver, player, chem, pos, chem_expr)))
+                event.update({"objective": solver.ObjectiveValue(), "bound": solver.BestObjectiveBound()})
+            self.emit(job, event)
+        except Exception as e:
+            self.emit(job, {"type": "done", "status": "ERROR", "error": repr(e)})
+
+    async def handle(self, reader, writer):
+        '''Minimal HTTP/1.1 handler'''
+        try:
+            request_line = (await reader.readline()).decode()
+            if not request_line:
+                return
+            method, path = request_line.split()[:2]
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode()
+                if line in ["\r\n", "\n", ""]:
+                    break
+                name, val = line.split(":", 1)
+                headers[name.strip().lower()] = val.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            await self.route(method, path.rstrip("/").split("/")[1:], body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, parts, body, writer):
+        if parts == ["jobs"] and method == "POST":
+            try:
+                job = self.submit(json.loads(body or b"{}"))
+            except ValueError as e:
+                return await send_json(writer, 400, {"error": str(e)})
+            if job is None:
+                return await send_json(writer, 503, {"error": "Too many queued jobs"})
+            return await send_json(writer, 202, {"job_id": job.job_id})
+        if parts == ["jobs"] and method == "GET":
+            return await send_json(writer, 200, [{"job_id": job.job_id, "status": job.status} for job in self.jobs.values()])
+        if len(parts) < 2 or parts[0] != "jobs" or not parts[1].isdigit() or int(parts[1]) not in self.jobs:
+            return await send_json(writer, 404, {"error": "Not found"})
+        job = self.jobs[int(parts[1])]
+        if len(parts) == 2 and method == "GET":
+            return await send_json(writer, 200, job.summary())
+        if len(parts) == 2 and method == "DELETE":
+            self.cancel(job)
+            return await send_json(writer, 200, {"job_id": job.job_id, "cancel_requested": True})
+        if parts[2:] == ["events"] and method == "GET":
+            return await self.stream_events(job, writer)
+        return await send_json(writer, 404, {"error": "Not found"})
+
+    async def stream_events(self, job, writer):
+        '''Stream all the events of a job (past and future) as chunked NDJSON'''
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        idx = 0
+        while True:
+            changed = job.changed
+            while idx < len(job.events):
+                data = (json.dumps(job.events[idx]) + "\n").encode()
+                writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+                idx += 1
+            await writer.drain()
+            if job.finished:
+                break
+            await changed.wait()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, HOST, port)
+        print(f"Listening on http://{HOST}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for job in self.jobs.values():
+                self.cancel(job)
+            self.executor.shutdown(wait = False, cancel_futures = True)
+
+def stop_if_cancelled(job, solver, solve_done):
+    '''Stop the search of a cancelled job (runs in its own thread until solve_done is set).
+    A StopSearch sent right before Solve starts is lost, so the flag is checked again while solving.
+    '''
+    while not solve_done.wait(CANCEL_POLL_INTERVAL):
+        if job.cancel_requested:
+            solver.StopSearch()
+
+async def send_json(writer, code, obj):
+    reason = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}[code]
+    data = json.dumps(obj).encode()
+    writer.write(f"HTTP/1.1 {code} {reason}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Local SBC solve server")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--workers", type = int, default = 1, help = "Number of jobs solved in parallel")
+    parser.add_argument("--max-queue", type = int, default = 16, help = "Max number of queued jobs")
+    parser.add_argument("--club", action = "append", default = [], help = "Club dataset to preload")
+    args = parser.parse_args()
+    solve_server = SolveServer(args.workers, args.max_queue)
+    for dataset in args.club:
+        solve_server.load_club(dataset)
+    try:
+        asyncio.run(solve_server.serve(args.port))
+    except KeyboardInterrupt:
+        pass
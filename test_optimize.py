@@ -0,0 +1,74 @@
+'''Regression checks for the model encodings. Run: py -m pytest test_optimize.py'''
+import pandas as pd
+import input
+import optimize
+
+def solve_status(df, constraints):
+    model = optimize.create_model(df, constraints)[0]
+    solver = optimize.create_solver(max_time = 30)
+    solver.parameters.log_search_progress = False
+    status = solver.Solve(model)
+    return solver.StatusName(status), solver.ObjectiveValue()
+
+def test_squad_rating_2_with_unpicked_class(monkeypatch):
+    '''An unpicked class of high rated cards must not cap the squad rating (multiplicity encoding)'''
+    monkeypatch.setattr(input, "SQUAD_RATING", 60)
+    monkeypatch.setattr(input, "CHEMISTRY", 0)
+    monkeypatch.setattr(input, "FIX_PLAYERS", [])
+    rows = [dict(Name = f"P{i}", Club = f"C{i}", League = f"L{i % 5}", Country = f"N{i % 7}", Position = "ANY",
+                 Rating = 62, Color = "Bronze", Rarity = "Common", Cost = 100 + i, IsDuplicate = False,
+                 Original_Idx = i) for i in range(22)]
+    rows += [dict(Name = f"S{i}", Club = "Star", League = "SL", Country = "SN", Position = "ANY",
+                  Rating = 95, Color = "Gold", Rarity = "Rare", Cost = 5000 + i, IsDuplicate = False,
+                  Original_Idx = 22 + i) for i in range(3)]
+    df = pd.DataFrame(rows)
+    expected = solve_status(df, ["squad_rating_2"])
+    assert expected == ("OPTIMAL", 1155)
+    monkeypatch.setattr(input, "USE_MULTIPLICITY_ENCODING", True)
+    assert solve_status(optimize.group_interchangeable_cards(df), ["squad_rating_2"]) == expected
+
+def test_session_add_players(monkeypatch):
+    '''Cards added to a session are appended to the existing model (same optimum as a fresh model)'''
+    monkeypatch.setattr(input, "CHEMISTRY", 15)
+    monkeypatch.setattr(input, "FIX_PLAYERS", [])
+    monkeypatch.setattr(input, "USE_MULTIPLICITY_ENCODING", False)
+    monkeypatch.setattr(optimize, "sbc_constraints", ["max_club", "rarity_2"])
+    monkeypatch.setattr(input, "MAX_NUM_CLUB", 4)
+    monkeypatch.setattr(input, "RARITY_2", ["Gold"])
+    monkeypatch.setattr(input, "NUM_RARITY_2", [6])
+    formation = input.formation_dict[input.FORMATION]
+    rows = [dict(Name = f"P{i}", Club = f"C{i % 6}", League = f"L{i % 3}", Country = f"N{i % 4}", Position = formation[i % 11],
+                 Rating = 70 + i % 10, Color = "Gold" if i % 3 else "Silver", Rarity = "Rare" if i % 2 else "Common",
+                 Cost = 1000 + (37 * i) % 500, IsDuplicate = False, Original_Idx = i) for i in range(60)]
+    df = pd.DataFrame(rows)
+    expected = solve_status(df, None)
+    assert expected[0] == "OPTIMAL"
+    session = optimize.SBCSession(df.iloc[:40].reset_index(drop = True))
+    session.add_players(df.iloc[40:])
+    assert not session._rebuild
+    squad = session.solve()
+    assert squad is not None and squad["Cost"].sum() == expected[1]
+
+def test_stream_async_cancel():
+    '''Cancelling the consuming task during the first next(stream) cancels the search'''
+    import asyncio
+    import threading
+    import time
+    import main
+    df = main.preprocess_data_2(pd.read_csv("Frederik FC_24.csv", index_col = False))
+    async def consume():
+        async for squad in optimize.SBC_stream_async(df):
+            pass
+    async def cancel_consumer():
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+    start = time.time()
+    assert asyncio.run(cancel_consumer())
+    assert time.time() - start < 120
+    assert not any(thread.name.endswith("(solve)") for thread in threading.enumerate())
@@ -0,0 +1,153 @@
+'''Solver parameter autotuning.
+
+Solves a challenge spec on the club datasets with a grid of solver parameters
+(and several seeds), appends every run to the history file and picks the best
+parameters for each tuning class (see optimize.get_tuning_classes). The picked
+parameters are written into input.TUNED_PARAMS_FILE and used at solve time
+when input.USE_TUNED_PARAMS = True.
+
+Run: py tune.py --time 60 --seeds 2
+     py tune.py --spec spec.json --dataset "Frederik FC_24.csv" --grid grid.json
+     py tune.py --summarize # Only recompute the tuned parameters from the history.
+
+The spec has the same format as in server.py (dataset is ignored). The grid is a
+list of solver parameter sets, e.g. [{"num_search_workers": 8}, {"num_search_workers": 16}].
+"stall_time_limit" (see input.STALL_TIME_LIMIT) can be tuned along with the solver parameters.
+'''
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+import pandas as pd
+import input
+import main
+import optimize
+
+HISTORY_FILE = "tuning_history.jsonl"
+
+DATASETS = ["Frederik FC_24.csv", "Real_Madrid_FC_24.csv", "Catamarca FC_24.csv", "Catamarca FC_25.csv"]
+
+PARAM_GRID = [
+    {"num_search_workers": 8},
+    {"num_search_workers": 16},
+    {"num_search_workers": 24},
+    {"num_search_workers": 16, "cp_model_presolve": False},
+    {"num_search_workers": 16, "linearization_level": 2},
+    {"num_search_workers": 16, "relative_gap_limit": 0.01},
+    {"num_search_workers": 16, "relative_gap_limit": 0.05},
+    {"num_search_workers": 16, "stall_time_limit": 30},
+    {"num_search_workers": 16, "stall_time_limit": 120},
+]
+
+# Score of a run without any solution (gaps of the other runs are in [0, 1]).
+NO_SOLUTION_GAP = 10
+
+def run_once(model, params, seed, max_time):
+    '''Solve the model once and record the objective and when the best solution was found'''
+    solver = optimize.create_solver(max_time = max_time)
+    solver.parameters.log_search_progress = False
+    solver.parameters.random_seed = seed
+    optimize.set_solver_params(solver, params)
+    start = time.time()
+    best_time = [None]
+    def on_solution(callback):
+        best_time[0] = time.time() - start
+    streamer = optimize.SolutionStreamer(solver.stall_time_limit, on_solution)
+    status = solver.Solve(model, streamer)
+    streamer.cancel_timer()
+    found = status == 2 or status == 4 # Feasible or Optimal
+    return {
+        "status": solver.StatusName(status),
+        "objective": solver.ObjectiveValue() if found else None,
+        "bound": solver.BestObjectiveBound() if found else None,
+        "time_to_best": best_time[0],
+        "wall_time": solver.WallTime()
+    }
+
+def tune(spec, datasets, grid, seeds, max_time):
+    '''Run the grid on every dataset and append the runs to the history file'''
+    for dataset in datasets:
+        if not os.path.exists(dataset):
+            print(f"**Dataset not found: {dataset}**")
+            continue
+        with optimize.input_overrides(spec.get("inputs", {}), keep = ["REMOVE_PLAYERS"]):
+            df = main.preprocess_data_2(pd.read_csv(dataset, index_col = False))
+            df = optimize.group_interchangeable_cards(df) if input.USE_MULTIPLICITY_ENCODING else df
+            model = optimize.create_model(df, spec.get("constraints"))[0]
+            features = optimize.get_features(df, spec.get("constraints"))
+            for params in grid:
+                for seed in range(seeds):
+                    print(f"{dataset} | {params} | seed {seed}")
+                    record = run_once(model, params, seed, max_time)
+                    print(f"Status: {record['status']}, Objective: {record['objective']}, Time to best: {record['time_to_best']}")
+                    record.update({"dataset": dataset, "features": features, "params": params, "seed": seed,
+                                   "max_time": max_time, "spec": spec})
+                    with open(HISTORY_FILE, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+
+def summarize():
+    '''Pick the best parameters of every tuning class from the history file'''
+    if not os.path.exists(HISTORY_FILE):
+        print(f"**No tuning history ({HISTORY_FILE}), run the grid first (py tune.py)**")
+        return
+    with open(HISTORY_FILE) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    # Best objective of every instance (dataset + features + spec) over all the runs.
+    instance = lambda r: json.dumps([r["dataset"], r["features"], r["spec"]], sort_keys = True)
+    maximize = lambda r: r["features"]["objective"] == "max_total_cost"
+    best = {}
+    for r in records:
+        if r["objective"] is None:
+            continue
+        key = instance(r)
+        better = max if maximize(r) else min
+        best[key] = r["objective"] if key not in best else better(best[key], r["objective"])
+    # Mean relative gap to the best objective (and mean time to best solution) of every parameter set in a class.
+    scores = defaultdict(lambda: defaultdict(list))
+    for r in records:
+        if instance(r) not in best:
+            continue # No solution in any run (e.g. infeasible).
+        if r["objective"] is None:
+            gap, time_to_best = NO_SOLUTION_GAP, r["max_time"]
+        else:
+            gap = abs(r["objective"] - best[instance(r)]) / max(abs(best[instance(r)]), 1)
+            time_to_best = r["time_to_best"] or 0
+        params = json.dumps(r["params"], sort_keys = True)
+        for tuning_class in optimize.get_tuning_classes(r["features"]):
+            scores[tuning_class][params].append((gap, time_to_best))
+    if not scores:
+        print(f"**No solved runs in {HISTORY_FILE}, {input.TUNED_PARAMS_FILE} is not changed**")
+        return
+    tuned_params = {}
+    for tuning_class, runs in sorted(scores.items()):
+        mean = lambda vals: tuple(sum(v[i] for v in vals) / len(vals) for i in range(2))
+        params, vals = min(runs.items(), key = lambda item: mean(item[1]))
+        gap, time_to_best = mean(vals)
+        tuned_params[tuning_class] = {"params": json.loads(params), "mean_gap": gap,
+                                      "mean_time_to_best": time_to_best, "num_runs": len(vals)}
+        print(f"{tuning_class}: {params} (gap: {gap:.4f}, time to best: {time_to_best:.1f}s)")
+    with open(input.TUNED_PARAMS_FILE, "w") as f:
+        json.dump(tuned_params, f, indent = 4)
+    print(f"Tuned parameters written into {input.TUNED_PARAMS_FILE}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Tune the solver parameters on the club datasets")
+    parser.add_argument("--spec", help = "Challenge spec (json). Default: The current input.py")
+    parser.add_argument("--dataset", action = "append", help = "Club dataset (can be repeated)")
+    parser.add_argument("--grid", help = "Solver parameter sets (json). Default: PARAM_GRID")
+    parser.add_argument("--seeds", type = int, default = 1, help = "Number of random seeds per parameter set")
+    parser.add_argument("--time", type = int, default = 120, help = "Time limit (in seconds) per run")
+    parser.add_argument("--summarize", action = "store_true", help = "Only pick the parameters from the history")
+    args = parser.parse_args()
+    if not args.summarize:
+        spec = {}
+        if args.spec:
+            with open(args.spec) as f:
+                spec = json.load(f)
+        grid = PARAM_GRID
+        if args.grid:
+            with open(args.grid) as f:
+                grid = json.load(f)
+        tune(spec, args.dataset or DATASETS, grid, args.seeds, args.time)
+    summarize()